@@ -0,0 +1,110 @@
+"""JSON API лент только для чтения.
+
+Посты выбираются через values() с минимальным набором полей и листаются тем же
+курсором, что и HTML-ленты. ETag строится из отметок изменения областей кэша
+страниц (posts.page_cache), поэтому на If-None-Match с неизменившейся лентой
+отвечаем 304, не выполняя ни одного SQL-запроса к постам.
+"""
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_safe
+
+from .models import ArchivedComment, ArchivedPost, Comment, Group, Post, User
+from .page_cache import SITE, etag_func
+from .storage import blob_storage
+from .timeline import archived as archived_timeline, timeline
+from .utils import CursorPaginator
+
+POST_FIELDS = {'username': F('author__username'), 'group_slug': F('group__slug')}
+COMMENT_FIELDS = {'username': F('author__username')}
+PAGE_SIZE = 20
+
+
+def _dumps(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False})
+
+
+def _not_found():
+    return _dumps({'detail': 'Не найдено'}, status=404)
+
+
+def _post(row):
+    row['image'] = blob_storage.url(row['image']) if row['image'] else None
+    return row
+
+
+def _page(request, queryset, fields=('pub_date', 'id'), serialize=_post, archived=None):
+    paginator = CursorPaginator(queryset, PAGE_SIZE, fields=fields, archive=archived)
+    rows, number, next_token, previous_token = paginator.page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    return {
+        'page': number,
+        'next': next_token,
+        'previous': previous_token,
+        'results': [serialize(row) for row in rows],
+    }
+
+
+def _posts(queryset=Post.objects):
+    return queryset.values('id', 'text', 'pub_date', 'image', 'comments_count', **POST_FIELDS)
+
+
+@require_safe
+@condition(etag_func=etag_func(lambda: ['index', SITE], per_user=False))
+def index(request):
+    return _dumps(_page(request, _posts(), archived=_posts(ArchivedPost.objects)))
+
+
+@require_safe
+@condition(etag_func=etag_func(lambda slug: [f'group:{slug}', SITE], per_user=False))
+def group_posts(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list('id', flat=True).first()
+    if group_id is None:
+        return _not_found()
+    archived = _posts(ArchivedPost.objects).filter(group_id=group_id)
+    return _dumps(_page(request, _posts().filter(group_id=group_id), archived=archived))
+
+
+@require_safe
+@condition(etag_func=etag_func(lambda username: [f'profile:{username}', SITE], per_user=False))
+def profile(request, username):
+    author_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+    if author_id is None:
+        return _not_found()
+    archived = _posts(ArchivedPost.objects).filter(author_id=author_id)
+    return _dumps(_page(request, _posts().filter(author_id=author_id), archived=archived))
+
+
+def _follow_etag(request):
+    # Любое изменение поста сбрасывает область index, подписки — область ленты пользователя
+    return etag_func(lambda: ['index', SITE, f'timeline:{request.user.id}'])(request)
+
+
+@require_safe
+@condition(etag_func=_follow_etag)
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return _dumps({'detail': 'Требуется авторизация'}, status=403)
+    archived = _posts(archived_timeline(request.user.id))
+    response = _dumps(_page(request, _posts(timeline(request.user.id)), archived=archived))
+    response['Cache-Control'] = 'private'
+    return response
+
+
+@require_safe
+@condition(etag_func=etag_func(lambda username, post_id: [f'post:{post_id}', SITE], per_user=False))
+def post_view(request, username, post_id):
+    comments = Comment.objects
+    post = _posts().filter(pk=post_id, author__username=username).first()
+    if post is None:
+        # Пост мог уйти в холодное хранение (posts.archive)
+        comments = ArchivedComment.objects
+        post = _posts(ArchivedPost.objects).filter(pk=post_id, author__username=username).first()
+    if post is None:
+        return _not_found()
+    comments = comments.filter(post_id=post_id).values('id', 'text', 'created', **COMMENT_FIELDS)
+    return _dumps({
+        'post': _post(post),
+        'comments': _page(request, comments, fields=('created', 'id'), serialize=dict),
+    })
@@ -0,0 +1,59 @@
+"""Холодное хранение старых постов.
+
+Команда archive_posts переносит посты старше ARCHIVE_AFTER_DAYS вместе с
+комментариями в ArchivedPost и ArchivedComment с теми же id, так что ссылки на
+посты не меняются. Ленты сначала читают горячую таблицу Post и обращаются к
+архиву, только когда страница доходит до границы — самого свежего поста архива,
+которую CursorPaginator читает из бд в той же транзакции, что и страницу.
+
+Перенос идёт в обход сигналов удаления: посты автора никуда не делись, поэтому
+posts_count в UserStats их по-прежнему учитывает (reconcile_users считает обе
+таблицы). Поисковый индекс тоже остаётся прежним: id не меняются, и поиск находит
+архивные посты (posts.search). Из материализованной ленты подписок и популярного
+посты уходят, лента подписок дочитывает их из архива, как и остальные ленты.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+
+from . import page_cache
+from .models import ArchivedComment, ArchivedPost, Comment, Post, PostTrend, TimelineEntry
+from .sqlite import serialized_write
+
+POST_FIELDS = ('id', 'text', 'pub_date', 'author_id', 'group_id', 'image', 'comments_count', 'version')
+COMMENT_FIELDS = ('id', 'post_id', 'author_id', 'text', 'created')
+
+
+def cutoff(days=None):
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    return timezone.now() - timedelta(days=days)
+
+
+def archive(older_than, batch_size=500):
+    """Переносит посты с pub_date раньше older_than в архив; возвращает (постов, комментариев)"""
+    posts = comments = 0
+    using = router.db_for_write(Post)
+    while True:
+        with serialized_write(using):
+            ids = list(
+                Post.objects.filter(pub_date__lt=older_than).order_by('pub_date', 'id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            ArchivedPost.objects.bulk_create(
+                ArchivedPost(**row) for row in Post.objects.filter(pk__in=ids).values(*POST_FIELDS)
+            )
+            ArchivedComment.objects.bulk_create(
+                ArchivedComment(**row) for row in Comment.objects.filter(post_id__in=ids).values(*COMMENT_FIELDS)
+            )
+            TimelineEntry.objects.filter(post_id__in=ids).delete()
+            PostTrend.objects.filter(post_id__in=ids).delete()
+            # Без сигналов удаления: счётчики постов и комментариев должны остаться прежними
+            comments += Comment.objects.filter(post_id__in=ids)._raw_delete(using)
+            posts += Post.objects.filter(pk__in=ids)._raw_delete(using)
+            # Каждая пачка видна вместе с новой отметкой, даже если перенос прервётся
+            page_cache.touch(page_cache.SITE)
+    return posts, comments
@@ -0,0 +1,196 @@
+"""Асинхронные варианты index, profile, post_view и follow_index для ASGI.
+
+ORM Django синхронный, поэтому независимые чтения страницы разбиты на группы:
+каждая группа целиком выполняется одним sync_to_async(thread_sensitive=False)
+в потоке пула на постоянном соединении этого потока (CONN_MAX_AGE), а группы
+идут параллельно через asyncio.gather. Переход в поток делается один раз на
+группу, а не на каждый запрос; рендер шаблона — последняя группа. Кэш страниц и условные ответы
+работают как у синхронных вьюх: отметки областей читаются одним запросом в
+потоке, остальная проверка ETag идёт в цикле событий.
+
+posts/urls.py подключает эти вьюхи вместо синхронных, когда включён
+settings.ASYNC_VIEWS (его включает yatube/asgi.py).
+"""
+import asyncio
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import follow_graph, metrics, page_cache
+from .counters import stats_for
+from .models import ArchivedPost, Post, User, UserStats
+from .page_cache import SITE
+from .recommendations import who_to_follow
+from .timeline import archived as archived_timeline, timeline
+from .utils import post_paginator
+from .views import comments_page, find_post, post_page_scopes, profile_scopes
+
+
+def in_thread(func):
+    """Обёртка, выполняющая func вместе со всеми её запросами в потоке пула за один переход"""
+    def run(*args, **kwargs):
+        try:
+            with metrics.instrument_connections():
+                return func(*args, **kwargs)
+        finally:
+            # Потоки пула не получают request_finished, поэтому проверка здесь: живое
+            # соединение потока остаётся для следующих групп (CONN_MAX_AGE), устаревшее
+            # или сломанное закрывается
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def gather(*groups):
+    """asyncio.gather, который дожидается всех групп и только потом пробрасывает первую ошибку.
+
+    Иначе после 404 из одной группы остальные продолжают читать бд в своих
+    потоках (и держать транзакции) уже после ответа.
+    """
+    results = await asyncio.gather(*groups, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def resolve_user(request):
+    """Загружает request.user; без куки сессии пользователь анонимный и бд не нужна"""
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        await in_thread(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def anonymous_page_cache(request, scopes, build):
+    """То же, что page_cache.anonymous_page_cache, для корутины build()"""
+    if request.method != 'GET' or request.user.is_authenticated:
+        return await build()
+    cached, slot = await in_thread(page_cache.lookup)(request, scopes)
+    if cached is not None:
+        return cached
+    try:
+        response = await build()
+        slot.store(response)
+    finally:
+        slot.release()
+    return response
+
+
+def condition(scopes):
+    """Асинхронный аналог django.views.decorators.http.condition с ETag и Last-Modified из page_cache"""
+    etag_func, last_modified_func = page_cache.etag_func(scopes), page_cache.last_modified_func(scopes)
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            await resolve_user(request)
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            # Отметки областей читаются из бд в потоке и запоминаются на request
+            await in_thread(page_cache.generations)(scopes(**kwargs), request)
+            etag = quote_etag(etag_func(request, **kwargs))
+            last_modified = last_modified_func(request, **kwargs)
+            last_modified = last_modified and timegm(last_modified.utctimetuple())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if last_modified and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified)
+            response.setdefault('ETag', etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def _stats(username):
+    return UserStats.objects.filter(user__username=username).first()
+
+
+def _render_index(request):
+    page, paginator = post_paginator(request, Post.objects.feed(), archive=ArchivedPost.objects.feed())
+    return render(request, 'index.html', {'page': page, 'paginator': paginator})
+
+
+async def index(request):
+    await resolve_user(request)
+    return await anonymous_page_cache(request, ['index', SITE], lambda: in_thread(_render_index)(request))
+
+
+def _render_profile(request, author, page, paginator, stats):
+    stats = stats or stats_for(author.id)
+    paginator.total = stats.posts_count
+    page.estimated_pages = paginator.estimated_pages
+    return render(request, 'posts/profile.html', {
+        'page': page,
+        'paginator': paginator,
+        'author': author,
+        'posts_count': stats.posts_count,
+        'followers': follow_graph.followers_count(author.id),
+        'following': follow_graph.following_count(author.id),
+        'follow': follow_graph.is_following(request.user.id, author.id),
+    })
+
+
+@condition(profile_scopes)
+async def profile(request, username):
+    async def build():
+        author, (page, paginator), stats = await gather(
+            in_thread(get_object_or_404)(User, username=username),
+            in_thread(post_paginator)(
+                request, Post.objects.feed().filter(author__username=username), 5,
+                archive=ArchivedPost.objects.feed().filter(author__username=username),
+            ),
+            in_thread(_stats)(username),
+        )
+        return await in_thread(_render_profile)(request, author, page, paginator, stats)
+    return await anonymous_page_cache(request, profile_scopes(username), build)
+
+
+def _render_post(request, author, post, stats, comments):
+    return render(request, 'posts/post.html', {
+        'post': post,
+        'author': author,
+        'posts_count': (stats or stats_for(author.id)).posts_count,
+        **comments,
+    })
+
+
+def _post_with_comments(request, post_id):
+    # Таблица комментариев зависит от того, где нашёлся пост
+    post = find_post(post_id)
+    return post, comments_page(request, post_id, archived=isinstance(post, ArchivedPost))
+
+
+@condition(post_page_scopes)
+async def post_view(request, username, post_id):
+    author, (post, comments), stats = await gather(
+        in_thread(get_object_or_404)(User, username=username),
+        in_thread(_post_with_comments)(request, post_id),
+        in_thread(_stats)(username),
+    )
+    return await in_thread(_render_post)(request, author, post, stats, comments)
+
+
+def _timeline_page(request, user_id):
+    return post_paginator(request, timeline(user_id).feed(), archive=archived_timeline(user_id).feed())
+
+
+async def follow_index(request):
+    user = await resolve_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    (page, paginator), authors = await gather(
+        in_thread(_timeline_page)(request, user.id),
+        in_thread(who_to_follow)(user),
+    )
+    return await in_thread(render)(request, 'follow.html', {
+        'page': page,
+        'paginator': paginator,
+        'recommended_authors': authors,
+    })
@@ -0,0 +1,53 @@
+"""Счётчики ссылок постов на файлы изображений.
+
+Хранилище по содержимому (posts.storage) отдаёт одинаковым загрузкам один файл,
+поэтому при удалении поста или замене картинки файл можно удалить, только если
+на него больше никто не ссылается. Сигналы постов увеличивают и уменьшают
+Blob.refs тем же UPDATE refs = refs ± 1, что и остальные счётчики; когда ссылок
+не осталось, файл вместе с миниатюрами удаляется после коммита. Перенос в архив
+(posts.archive) идёт в обход сигналов, и ссылка просто переходит к ArchivedPost.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+from sorl.thumbnail import delete
+
+from .models import ArchivedPost, Blob, Post
+from .sqlite import serialized_write
+
+
+def acquire(name):
+    if not name:
+        return
+    if not Blob.objects.filter(name=name).update(refs=F('refs') + 1):
+        _, created = Blob.objects.get_or_create(name=name, defaults={'refs': 1})
+        if not created:
+            Blob.objects.filter(name=name).update(refs=F('refs') + 1)
+
+
+def release(name):
+    if not name:
+        return
+    Blob.objects.filter(name=name).update(refs=F('refs') - 1)
+    if Blob.objects.filter(name=name, refs__lte=0).delete()[0]:
+        transaction.on_commit(lambda: _remove(name))
+
+
+def _remove(name):
+    # Пока транзакция шла, файл могли загрузить заново
+    if Blob.objects.filter(name=name).exists():
+        return
+    field = Post._meta.get_field('image')
+    delete(field.attr_class(None, field, name))
+
+
+def rebuild():
+    """Пересчитывает ссылки по постам после массовой загрузки в обход сигналов"""
+    refs = Counter()
+    for model in (Post, ArchivedPost):
+        images = model.objects.exclude(image='').exclude(image=None)
+        refs.update(dict(images.values_list('image').annotate(total=Count('pk')).order_by()))
+    with serialized_write():
+        Blob.objects.all().delete()
+        Blob.objects.bulk_create(Blob(name=name, refs=total) for name, total in refs.items())
@@ -0,0 +1,77 @@
+"""Денормализованные счётчики постов, подписчиков, подписок и комментариев.
+
+Счётчики меняются атомарным UPDATE ... SET x = x + 1 из сигналов при создании
+и удалении записей; расхождения исправляет команда reconcile_counters.
+В posts_count входят и посты в холодном хранении (posts.archive).
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import ArchivedPost, Comment, Follow, Post, UserStats
+
+STATS_FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+
+def _count(queryset, field):
+    counted = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk'))
+    return Coalesce(Subquery(counted.values('total')), 0)
+
+
+def actual_stats(user_id):
+    return {
+        'posts_count': (
+            Post.objects.filter(author_id=user_id).count() + ArchivedPost.objects.filter(author_id=user_id).count()
+        ),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def stats_for(user_id):
+    """Счётчики пользователя; если строки ещё нет, она создаётся пересчётом"""
+    stats = UserStats.objects.filter(user_id=user_id).first()
+    if stats is None:
+        stats, _ = UserStats.objects.get_or_create(user_id=user_id, defaults=actual_stats(user_id))
+    return stats
+
+
+def bump_user(user_id, **deltas):
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        # Строка создаётся пересчётом, который уже учитывает текущее изменение.
+        # При уменьшении строки может не быть из-за каскадного удаления пользователя.
+        stats_for(user_id)
+
+
+def bump_comments(post_id, delta):
+    # Число комментариев выводится в карточке поста, поэтому меняется и её версия
+    Post.objects.filter(pk=post_id).update(comments_count=F('comments_count') + delta, version=F('version') + 1)
+
+
+def reconcile_users(queryset):
+    """Пересчитывает счётчики пользователей, возвращает число исправленных строк"""
+    actual = queryset.annotate(
+        actual_posts=_count(Post.objects, 'author') + _count(ArchivedPost.objects, 'author'),
+        actual_followers=_count(Follow.objects, 'author'),
+        actual_following=_count(Follow.objects, 'user'),
+    )
+    fixed = 0
+    for user_id, posts, followers, following in actual.values_list(
+        'pk', 'actual_posts', 'actual_followers', 'actual_following'
+    ).iterator():
+        values = {'posts_count': posts, 'followers_count': followers, 'following_count': following}
+        stats, created = UserStats.objects.get_or_create(user_id=user_id, defaults=values)
+        if not created and any(getattr(stats, field) != values[field] for field in STATS_FIELDS):
+            UserStats.objects.filter(user_id=user_id).update(**values)
+            fixed += 1
+        fixed += created
+    return fixed
+
+
+def reconcile_comments():
+    drifted = Post.objects.annotate(actual=_count(Comment.objects, 'post')).exclude(comments_count=F('actual'))
+    return Post.objects.filter(pk__in=drifted.values('pk')).update(
+        comments_count=_count(Comment.objects, 'post')
+    )
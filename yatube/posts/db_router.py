@@ -0,0 +1,126 @@
+"""Чтение с реплик, запись в основную базу.
+
+PrimaryReplicaMiddleware отмечает каждый запрос: безопасные (GET, HEAD) читают
+с одной из реплик settings.DATABASE_REPLICAS, остальные целиком работают с
+основной базой. Всё, что выполняется вне запроса (команды, воркеры), тоже
+читает с основной. Если запрос что-то записал (track_writes видит INSERT,
+UPDATE или DELETE на соединении основной базы), в ответ ставится кука
+PRIMARY_PIN_COOKIE на PRIMARY_PIN_SECONDS: пока она есть, браузер читает с
+основной базы и видит свои изменения, даже если реплика ещё отстаёт.
+
+Кэш страниц для гостей может собрать страницу с отстающей реплики уже после
+того, как запись сбросила его отметку, — такая страница живёт до следующего
+изменения её областей.
+"""
+import asyncio
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_route = ContextVar('db_route', default=None)
+
+
+class Route:
+    """Маршрут запросов к бд одного HTTP-запроса"""
+
+    def __init__(self, replicas_allowed):
+        self.replicas_allowed = replicas_allowed
+        self.replica = None
+        self.wrote = False
+
+
+@contextmanager
+def routing(replicas_allowed):
+    route = Route(replicas_allowed and bool(settings.DATABASE_REPLICAS))
+    token = _route.set(route)
+    try:
+        yield route
+    finally:
+        _route.reset(token)
+
+
+def use_primary(view):
+    """Для вьюх, которые пишут в бд и на GET (подписки): все их чтения — с основной базы"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        route = _route.get()
+        if route is not None:
+            route.replicas_allowed = False
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def track_writes(execute, sql, params, many, context):
+    """execute_wrapper основной базы: отмечает запрос, который действительно что-то записал"""
+    route = _route.get()
+    if route is not None and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        route.wrote = True
+    return execute(sql, params, many, context)
+
+
+def watch(connection):
+    if connection.alias == DEFAULT_DB_ALIAS and track_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_writes)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        route = _route.get()
+        if route is None or not route.replicas_allowed:
+            return DEFAULT_DB_ALIAS
+        if route.replica is None:
+            # Все чтения запроса идут в одну реплику, чтобы не смешивать разное отставание
+            route.replica = random.choice(settings.DATABASE_REPLICAS)
+        return route.replica
+
+    def db_for_write(self, model, **hints):
+        # Выбор базы для записи ещё не запись: get_or_create и select_for_update спрашивают его и для чтения
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    @staticmethod
+    def replicas_allowed(request):
+        return request.method in SAFE_METHODS and settings.PRIMARY_PIN_COOKIE not in request.COOKIES
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with routing(self.replicas_allowed(request)) as route:
+            response = self.get_response(request)
+        return self.pin(route, response)
+
+    async def __acall__(self, request):
+        with routing(self.replicas_allowed(request)) as route:
+            response = await self.get_response(request)
+        return self.pin(route, response)
+
+    @staticmethod
+    def pin(route, response):
+        if route.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                settings.PRIMARY_PIN_COOKIE, '1', max_age=settings.PRIMARY_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
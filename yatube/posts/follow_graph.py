@@ -0,0 +1,174 @@
+"""Индекс подписок в памяти процесса.
+
+Для каждого пользователя хранятся отсортированные массивы id авторов, на
+которых он подписан, и id его подписчиков (array('q'), поиск через bisect),
+поэтому «подписан ли», число подписчиков и подписок отвечаются за O(log n)
+без запроса к базе. Индекс загружается при первом обращении. Сигналы Follow
+пишут изменение в журнал FollowChange в той же транзакции, что и саму
+подписку: откаченная подписка в журнал не попадает. Процессы не чаще раза в
+FOLLOW_GRAPH_SYNC_INTERVAL секунд проигрывают новые записи журнала, а если
+последней проигранной записи в журнале больше нет (её откатили или журнал
+подрезан) или изменений слишком много, загружают индекс заново. Индекс только
+для отображения: подписку и отписку вьюхи всегда проверяют записью в бд.
+"""
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import metrics
+from .models import Follow, FollowChange
+
+# Сколько изменений можно проиграть, прежде чем проще загрузить индекс заново
+MAX_REPLAY = 1000
+# Раз в столько записей журнал подрезается, оставляя последние KEEP_CHANGES
+PRUNE_EVERY = 1000
+KEEP_CHANGES = 10 * MAX_REPLAY
+FIELDS = ('pk', 'created', 'user_id', 'author_id')
+
+_lock = threading.RLock()
+_following = None
+_followers = None
+# Последняя проигранная запись журнала и время последней сверки
+_last = None
+_checked = 0
+_pending = False
+
+
+def _contains(values, value):
+    position = bisect_left(values, value)
+    return position < len(values) and values[position] == value
+
+
+def _insert(index, key, value):
+    values = index.get(key)
+    if values is None:
+        index[key] = array('q', [value])
+        return
+    position = bisect_left(values, value)
+    if position == len(values) or values[position] != value:
+        values.insert(position, value)
+
+
+def _remove(index, key, value):
+    values = index.get(key)
+    if values is None:
+        return
+    position = bisect_left(values, value)
+    if position < len(values) and values[position] == value:
+        del values[position]
+        if not values:
+            del index[key]
+
+
+def _apply(created, user_id, author_id):
+    change = _insert if created else _remove
+    change(_following, user_id, author_id)
+    change(_followers, author_id, user_id)
+
+
+def _using():
+    # Индекс общий для всех запросов процесса, поэтому читается с основной базы, а не с реплики запроса
+    return DEFAULT_DB_ALIAS
+
+
+def _load():
+    global _following, _followers, _last, _checked, _pending
+    using = _using()
+    # Журнал читается до данных: изменения между ними проиграются повторно, это безопасно
+    last = FollowChange.objects.using(using).order_by('-pk').values_list(*FIELDS).first()
+    following, followers = {}, {}
+    rows = Follow.objects.using(using).order_by('user_id', 'author_id').values_list('user_id', 'author_id')
+    for user_id, author_id in rows.iterator():
+        following.setdefault(user_id, array('q')).append(author_id)
+        # Внутри каждого автора подписчики приходят по возрастанию user_id
+        followers.setdefault(author_id, array('q')).append(user_id)
+    _following, _followers, _last = following, followers, last
+    _checked, _pending = time.monotonic(), False
+
+
+def _sync():
+    """Проигрывает новые записи журнала; если их не восстановить, загружает индекс заново"""
+    global _last, _checked, _pending
+    with _lock:
+        if _following is None:
+            _load()
+            return
+        now = time.monotonic()
+        if not _pending and now - _checked < settings.FOLLOW_GRAPH_SYNC_INTERVAL:
+            return
+        changes = list(
+            FollowChange.objects.using(_using()).filter(pk__gte=_last[0] if _last else 0)
+            .order_by('pk').values_list(*FIELDS)[:MAX_REPLAY + 1]
+        )
+        if _last is not None:
+            if not changes or changes[0] != _last:
+                _load()
+                return
+            changes = changes[1:]
+        if len(changes) >= MAX_REPLAY or any(created is None for _, created, _, _ in changes):
+            _load()
+            return
+        for _, created, user_id, author_id in changes:
+            _apply(created, user_id, author_id)
+        if changes:
+            _last = changes[-1]
+        _checked, _pending = now, False
+
+
+def record(created, user_id, author_id):
+    """Пишет подписку (created=True) или отписку в журнал в текущей транзакции"""
+    global _pending
+    change = FollowChange.objects.create(created=created, user_id=user_id, author_id=author_id)
+    if change.pk % PRUNE_EVERY == 0:
+        FollowChange.objects.filter(pk__lte=change.pk - KEEP_CHANGES).delete()
+    # Свои изменения процесс проигрывает при следующем обращении, не дожидаясь интервала
+    _pending = True
+
+
+def is_following(user_id, author_id):
+    if user_id is None:
+        return False
+    _sync()
+    return _contains(_following.get(user_id, ()), author_id)
+
+
+def following_count(user_id):
+    _sync()
+    return len(_following.get(user_id, ()))
+
+
+def followers_count(author_id):
+    _sync()
+    return len(_followers.get(author_id, ()))
+
+
+def memory_usage():
+    """Примерный объём индекса в байтах (0, пока он не загружен)"""
+    with _lock:
+        if _following is None:
+            return 0
+        total = sys.getsizeof(_following) + sys.getsizeof(_followers)
+        for index in (_following, _followers):
+            total += sum(sys.getsizeof(key) + sys.getsizeof(values) for key, values in index.items())
+        return total
+
+
+def reset():
+    """Забывает индекс процесса; следующее обращение загрузит его заново"""
+    global _following, _followers, _last
+    with _lock:
+        _following = _followers = _last = None
+
+
+def invalidate():
+    """После массовых изменений в обход сигналов: все процессы загрузят индекс заново"""
+    FollowChange.objects.create(created=None)
+    reset()
+
+
+metrics.registry.register_gauge('follow_graph_bytes', 'Память индекса подписок процесса', memory_usage)
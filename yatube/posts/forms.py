@@ -1,12 +1,47 @@
 from django import forms
+from django.conf import settings
+from PIL import Image
 
-from .models import Post, Comment
+from .models import Post, Comment, Group, User
+
+
+class HeaderCheckedImageField(forms.ImageField):
+    """ImageField, который до полной проверки Pillow читает только заголовок
+    и отклоняет изображения больше POST_IMAGE_MAX_PIXELS"""
+    default_error_messages = {
+        'too_large': 'Изображение слишком большое, допустимо до %(limit)s пикселей.',
+    }
+
+    def to_python(self, data):
+        if data not in self.empty_values and hasattr(data, 'seek'):
+            self.check_size(data)
+        return super().to_python(data)
+
+    def check_size(self, data):
+        try:
+            # Image.open разбирает только заголовок, пиксели не декодируются
+            with Image.open(data) as image:
+                width, height = image.size
+            too_large = width * height > settings.POST_IMAGE_MAX_PIXELS
+        except Image.DecompressionBombError:
+            too_large = True
+        except Exception:
+            # Не изображение: ошибку покажет полная проверка ImageField
+            too_large = False
+        finally:
+            data.seek(0)
+        if too_large:
+            raise forms.ValidationError(
+                self.error_messages['too_large'], code='too_large',
+                params={'limit': settings.POST_IMAGE_MAX_PIXELS},
+            )
 
 
 class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
+        field_classes = {'image': HeaderCheckedImageField}
         labels = {
             'text': 'Текст',
             'group': 'Группа',
@@ -36,3 +71,17 @@ class CommentForm(forms.ModelForm):
                 'class': 'form-control',
             }),
         }
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField(label='Поиск', max_length=200, widget=forms.TextInput(attrs={
+        'class': 'form-control',
+    }))
+    group = forms.ModelChoiceField(
+        label='Группа', queryset=Group.objects.all(), required=False, to_field_name='slug',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    author = forms.ModelChoiceField(
+        label='Автор', queryset=User.objects.all(), required=False, to_field_name='username',
+        widget=forms.TextInput(attrs={'class': 'form-control'}),
+    )
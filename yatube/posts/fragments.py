@@ -0,0 +1,63 @@
+"""Кэш отрендеренных карточек постов.
+
+Карточка кэшируется по id поста и его версии (Post.version увеличивается при
+редактировании и новых комментариях). В ключ также входит отпечаток имени
+автора и группы, так что их переименование тоже даёт новый ключ. Карточка не
+зависит от зрителя: ссылка «Редактировать» вставляется на место маркера
+отдельно, поэтому один фрагмент отдаётся всем пользователям.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from . import metrics
+from .models import Post
+
+EDIT_LINK_MARKER = '<!--post-edit-link-->'
+
+
+def card_key(post):
+    group = post.group
+    fingerprint = ':'.join(map(str, (
+        post.pub_date.timestamp(),
+        post.author.username,
+        group.slug if group else '',
+        group.title if group else '',
+    )))
+    digest = hashlib.md5(fingerprint.encode()).hexdigest()[:12]
+    return f'post_card:{post.id}:{post.version}:{digest}'
+
+
+def edit_link(post):
+    return format_html(
+        '<a class="btn btn-sm text-muted" href="{}" role="button">Редактировать</a>',
+        reverse('post_edit', args=[post.author.username, post.id]),
+    )
+
+
+def render_cards(posts, user):
+    """Собирает HTML карточек из кэша одним get_many, недостающие рендерит и кладёт в кэш"""
+    posts = list(posts)
+    keys = {post.id: card_key(post) for post in posts}
+    cached = cache.get_many(list(keys.values()))
+    template = None
+    rendered = {}
+    cards = []
+    for post in posts:
+        html = cached.get(keys[post.id])
+        if html is None:
+            template = template or get_template('post_card.html')
+            html = rendered[keys[post.id]] = template.render({'post': post})
+        # Архивные посты (posts.archive) только для чтения
+        if user.id == post.author_id and isinstance(post, Post):
+            html = html.replace(EDIT_LINK_MARKER, edit_link(post))
+        cards.append(html)
+    metrics.count_cache('card', hits=len(cached), misses=len(rendered))
+    if rendered:
+        cache.set_many(rendered, settings.POST_CARD_CACHE_TIMEOUT)
+    return mark_safe(''.join(cards))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import archive
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые посты вместе с комментариями в холодное хранение'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Возраст поста в днях, по умолчанию settings.ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500, help='Постов за одну транзакцию')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days не может быть отрицательным')
+        older_than = archive.cutoff(options['days'])
+        posts, comments = archive.archive(older_than, options['batch_size'])
+        self.stdout.write(
+            f'В архив перенесено постов {posts}, комментариев {comments} (опубликованы до {older_than:%Y-%m-%d})'
+        )
@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Post, User, UserStats
+
+CLIENT_ADDRESS = '192.0.2.1'
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность и задержку лент под WSGI (пул потоков) '
+            'и ASGI (асинхронные вьюхи) при большом числе одновременных запросов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('both', 'wsgi', 'asgi'), default='both',
+                            help='both запускает оба режима в отдельных процессах')
+        parser.add_argument('--concurrency', type=int, default=100, help='Одновременных запросов')
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на страницу')
+        parser.add_argument('--threads', type=int, default=16, help='Потоков для запросов к бд')
+        parser.add_argument('--user', help='От чьего имени открывать ленты (по умолчанию — у кого больше всего подписок)')
+
+    def urls(self):
+        author_id = UserStats.objects.order_by('-posts_count').values_list('user_id', flat=True).first()
+        author = User.objects.filter(pk=author_id).first()
+        post = Post.objects.select_related('author').order_by('-comments_count', '-id').first()
+        if author is None or post is None:
+            raise CommandError('В базе нет постов, сначала выполните seed_data')
+        return {
+            'index': reverse('index'),
+            'profile': reverse('profile', kwargs={'username': author.username}),
+            'post_view': reverse('post', kwargs={'username': post.author.username, 'post_id': post.id}),
+            'follow_index': reverse('follow_index'),
+        }
+
+    def session_cookie(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user_id = UserStats.objects.order_by('-following_count').values_list('user_id', flat=True).first()
+            user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            raise CommandError('Пользователь не найден, сначала выполните seed_data')
+        client = Client()
+        client.force_login(user)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'both':
+            for mode, async_views in (('wsgi', '0'), ('asgi', '1')):
+                # ASYNC_VIEWS читается при загрузке настроек, поэтому каждый режим — свой процесс
+                arguments = [sys.argv[0], 'benchmark_asgi', '--mode', mode]
+                for name in ('concurrency', 'requests', 'threads', 'user'):
+                    if options[name] is not None:
+                        arguments += [f'--{name}', str(options[name])]
+                result = subprocess.run(
+                    [sys.executable, *arguments],
+                    env={**os.environ, 'YATUBE_ASYNC_VIEWS': async_views},
+                    stdout=subprocess.PIPE, universal_newlines=True,
+                )
+                if result.returncode:
+                    raise CommandError(f'Замер {mode} завершился с ошибкой')
+                self.stdout.write(result.stdout, ending='')
+            return
+        if (options['mode'] == 'asgi') != settings.ASYNC_VIEWS:
+            self.stderr.write('Внимание: YATUBE_ASYNC_VIEWS не соответствует режиму, вьюхи будут другого вида')
+
+        self.threads = options['threads']
+        cookie = self.session_cookie(options['user'])
+        run = self.run_asgi if options['mode'] == 'asgi' else self.run_wsgi
+        self.stdout.write(
+            f'{options["mode"].upper()}: одновременных запросов {options["concurrency"]}, '
+            f'запросов на страницу {options["requests"]}'
+        )
+        self.stdout.write(f'{"страница":<16} {"запр/с":>9} {"p50, мс":>9} {"p95, мс":>9} {"соедин.":>8}')
+        for name, url in self.urls().items():
+            headers = {'cookie': cookie} if name == 'follow_index' else {}
+            run(url, headers, options['concurrency'], 10)
+            # Каждый замер идёт в новом пуле потоков, поэтому открытие соединений
+            # (и PRAGMA на каждом) входит в замер; столбец «соедин.» — сколько их открыто
+            opened = itertools.count()
+
+            def count_connection(**kwargs):
+                next(opened)
+
+            connection_created.connect(count_connection)
+            try:
+                elapsed, timings = run(url, headers, options['concurrency'], options['requests'])
+            finally:
+                connection_created.disconnect(count_connection)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f'{name:<16} {len(timings) / elapsed:>9.1f} '
+                f'{statistics.median(timings) * 1000:>9.2f} {p95 * 1000:>9.2f} {next(opened):>8}'
+            )
+
+    @staticmethod
+    def check_status(url, status):
+        if status != 200:
+            raise CommandError(f'{url}: ответ {status}')
+
+    def run_wsgi(self, url, headers, concurrency, total):
+        """Обычное развёртывание: поток на запрос из пула размером concurrency"""
+        application = WSGIHandler()
+        path, _, query = url.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': settings.ALLOWED_HOSTS[0], 'SERVER_PORT': '80', 'HTTP_HOST': settings.ALLOWED_HOSTS[0],
+            'REMOTE_ADDR': CLIENT_ADDRESS, 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            environ[f'HTTP_{name.upper()}'] = value
+
+        def request(_):
+            statuses = []
+            start = time.perf_counter()
+            response = application({**environ, 'wsgi.input': BytesIO()}, lambda status, _: statuses.append(status))
+            b''.join(response)
+            response.close()
+            self.check_status(url, int(statuses[0].split()[0]))
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            timings = list(pool.map(request, range(total)))
+            return time.perf_counter() - start, timings
+
+    def run_asgi(self, url, headers, concurrency, total):
+        """Все запросы в одном цикле событий; бд — в пуле из --threads потоков"""
+        application = ASGIHandler()
+        split = urlsplit(url)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': split.path, 'raw_path': split.path.encode(), 'query_string': split.query.encode(),
+            'root_path': '', 'client': (CLIENT_ADDRESS, 50000), 'server': (settings.ALLOWED_HOSTS[0], 80),
+            'headers': [(b'host', settings.ALLOWED_HOSTS[0].encode())]
+            + [(name.encode(), value.encode()) for name, value in headers.items()],
+        }
+
+        async def request():
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            start = time.perf_counter()
+            await application(dict(scope), receive, send)
+            self.check_status(url, messages[0]['status'])
+            return time.perf_counter() - start
+
+        async def main():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.threads))
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def limited():
+                async with semaphore:
+                    return await request()
+
+            start = time.perf_counter()
+            timings = await asyncio.gather(*(limited() for _ in range(total)))
+            return time.perf_counter() - start, list(timings)
+
+        return asyncio.run(main())
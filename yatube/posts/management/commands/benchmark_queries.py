@@ -0,0 +1,62 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from posts.models import Comment, Follow, Post, UserStats
+
+INDEXED_MODELS = (Post, Comment)
+
+
+class Command(BaseCommand):
+    help = 'Показывает план и время горячих запросов лент, с составными индексами и без них'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument(
+            '--compare', action='store_true',
+            help='Повторить замеры без составных индексов (индексы удаляются в откатываемой транзакции)',
+        )
+
+    def queries(self):
+        author_id = UserStats.objects.order_by('-posts_count').values_list('user_id', flat=True).first()
+        user_id = UserStats.objects.order_by('-following_count').values_list('user_id', flat=True).first()
+        group_id = Post.objects.exclude(group=None).values_list('group_id', flat=True).first()
+        post_id = Post.objects.order_by('-comments_count').values_list('id', flat=True).first()
+        return {
+            'index': Post.objects.feed()[:10],
+            'profile': Post.objects.feed().filter(author_id=author_id)[:10],
+            'group_posts': Post.objects.feed().filter(group_id=group_id)[:10],
+            'comments': Comment.objects.filter(post_id=post_id).order_by('-created', '-id')[:20],
+            'follow_check': Follow.objects.filter(user_id=user_id, author_id=author_id),
+        }
+
+    def measure(self, runs):
+        for name, queryset in self.queries().items():
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(f'{name}: median {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms')
+            self.stdout.write(f'    {queryset.explain()}'.replace('\n', '\n    '))
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING('С индексами:'))
+        self.measure(options['runs'])
+        if not options['compare']:
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING('Без составных индексов:'))
+        # Новое соединение: SQLite кэширует подготовленные запросы вместе с планами
+        connection.close()
+        with transaction.atomic():
+            schema_editor = connection.schema_editor()
+            with connection.cursor() as cursor:
+                for model in INDEXED_MODELS:
+                    for index in model._meta.indexes:
+                        cursor.execute(str(index.remove_sql(model, schema_editor)))
+            self.measure(options['runs'])
+            transaction.set_rollback(True)
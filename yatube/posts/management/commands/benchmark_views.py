@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Group, Post, User, UserStats
+
+# Адрес не из INTERNAL_IPS, чтобы в ответы не встраивалась debug toolbar
+CLIENT_ADDRESS = '192.0.2.1'
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку, число SQL-запросов и размер ответа основных страниц через тестовый клиент'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2, help='Прогоны перед замером, не попадают в статистику')
+        parser.add_argument('--user', help='От чьего имени открывать ленты (по умолчанию — у кого больше всего подписок)')
+        parser.add_argument('--anonymous', action='store_true', help='Открывать публичные страницы без входа (через кэш страниц)')
+
+    def urls(self, user):
+        author_id = UserStats.objects.order_by('-posts_count').values_list('user_id', flat=True).first()
+        author = User.objects.filter(pk=author_id).first() or user
+        group = Group.objects.annotate(total=Count('group_posts')).order_by('-total').first()
+        post = Post.objects.select_related('author').order_by('-comments_count', '-id').first()
+        urls = {'index': reverse('index')}
+        if group is not None:
+            urls['group_posts'] = reverse('group_posts', kwargs={'slug': group.slug})
+        urls['profile'] = reverse('profile', kwargs={'username': author.username})
+        if post is not None:
+            urls['post_view'] = reverse('post', kwargs={'username': post.author.username, 'post_id': post.id})
+        urls['follow_index'] = reverse('follow_index')
+        urls['followers_index'] = reverse('followers_index')
+        return urls
+
+    def request(self, client, url):
+        """Возвращает (мс, SQL-запросов, байт ответа)"""
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        return elapsed, len(queries), len(response.content)
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+        else:
+            user_id = UserStats.objects.order_by('-following_count').values_list('user_id', flat=True).first()
+            user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            raise CommandError('В базе нет пользователей, сначала выполните seed_data')
+
+        client = Client(REMOTE_ADDR=CLIENT_ADDRESS, HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        anonymous = Client(REMOTE_ADDR=CLIENT_ADDRESS, HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        client.force_login(user)
+        private = {'follow_index', 'followers_index'}
+
+        self.stdout.write(f'Пользователь {user.username}, прогонов {options["runs"]}')
+        self.stdout.write(f'{"страница":<16} {"p50, мс":>9} {"p95, мс":>9} {"запросов":>9} {"байт":>9}')
+        for name, url in self.urls(user).items():
+            view_client = anonymous if options['anonymous'] and name not in private else client
+            for _ in range(options['warmup']):
+                self.request(view_client, url)
+            results = []
+            for _ in range(options['runs']):
+                results.append(self.request(view_client, url))
+            timings = sorted(elapsed for elapsed, _, _ in results)
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            queries = max(count for _, count, _ in results)
+            size = round(statistics.mean(size for _, _, size in results))
+            self.stdout.write(f'{name:<16} {statistics.median(timings):>9.2f} {p95:>9.2f} {queries:>9} {size:>9}')
@@ -0,0 +1,34 @@
+import json
+import sys
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = 'Выгружает группы, посты, комментарии и подписки в NDJSON потоком, не держа таблицы в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки, «-» — стандартный вывод')
+        parser.add_argument('--models', nargs='+', choices=transfer.MODELS, default=transfer.MODELS)
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Строк за одно чтение из курсора бд')
+
+    def handle(self, *args, **options):
+        output = sys.stdout if options['path'] == '-' else open(options['path'], 'w', encoding='utf-8')
+        written = Counter()
+        try:
+            # Одна транзакция — один снимок: комментарии не сошлются на посты, которых нет в выгрузке
+            with transaction.atomic():
+                for row in transfer.export_rows(options['models'], options['chunk_size']):
+                    output.write(json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder))
+                    output.write('\n')
+                    written[row['model']] += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        report = ', '.join(f'{model} {written[model]}' for model in options['models'])
+        (self.stderr if output is sys.stdout else self.stdout).write(f'Выгружено: {report}')
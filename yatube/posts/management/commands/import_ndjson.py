@@ -0,0 +1,79 @@
+import json
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+from posts.models import Comment, Post
+from posts.sqlite import serialized_write
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON из export_ndjson пачками через bulk_create. После каждой пачки позиция '
+            'в файле сохраняется в <файл>.checkpoint, и прерванная загрузка продолжается с неё')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--restart', action='store_true', help='Начать сначала, не глядя на checkpoint')
+        parser.add_argument('--merge', action='store_true',
+                            help='Загружать в базу, где уже есть посты (их id не должны совпадать с id из файла)')
+        parser.add_argument('--no-create-users', action='store_true',
+                            help='Пропускать записи пользователей, которых нет в базе, вместо их создания')
+        parser.add_argument('--no-rebuild', action='store_true',
+                            help='Не пересчитывать счётчики, ленты и индексы (например, если дальше ещё файлы)')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.checkpoint = f'{options["path"]}.checkpoint'
+        offset = 0
+        if os.path.exists(self.checkpoint) and not options['restart']:
+            with open(self.checkpoint) as checkpoint:
+                offset = json.load(checkpoint)['offset']
+            self.stdout.write(f'Продолжаем с байта {offset}')
+        elif not options['merge'] and (Post.objects.exists() or Comment.objects.exists()):
+            raise CommandError('В базе уже есть посты или комментарии, их id могут совпасть с загружаемыми; '
+                               'если это не так, добавьте --merge')
+
+        self.loader = transfer.Loader(create_users=not options['no_create_users'])
+        self.loaded = Counter()
+        batch_size = options['batch_size']
+        with open(options['path'], 'rb') as source:
+            source.seek(offset)
+            model, batch, position = None, [], offset
+            for line in source:
+                if line.strip():
+                    record = json.loads(line)
+                    kind = record.pop('model', None)
+                    if kind not in transfer.MODELS:
+                        raise CommandError(f'Неизвестная запись на байте {position}: {kind!r}')
+                    if batch and (kind != model or len(batch) >= batch_size):
+                        self.flush(model, batch, position)
+                        batch = []
+                    model = kind
+                    batch.append(record)
+                position += len(line)
+            if batch:
+                self.flush(model, batch, position)
+
+        if not options['no_rebuild']:
+            self.stdout.write('Пересчёт счётчиков, лент и индексов')
+            transfer.rebuild_derived()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        report = ', '.join(f'{model} {self.loaded[model]}' for model in transfer.MODELS)
+        self.stdout.write(self.style.SUCCESS(f'Загружено: {report}'))
+        if self.loader.missing_users:
+            self.stdout.write(f'Не найдено пользователей, их записи пропущены: {self.loader.missing_users}')
+
+    def flush(self, model, batch, offset):
+        with serialized_write():
+            self.loaded[model] += self.loader.load(model, batch)
+        # Позиция пишется после фиксации пачки: при сбое между ними пачка загрузится повторно без дублей
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump({'offset': offset}, checkpoint)
+        os.replace(temporary, self.checkpoint)
+        if self.verbosity > 1:
+            self.stdout.write(f'{model}: {self.loaded[model]}, байт {offset}')
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts import trends
+from posts.sqlite import serialized_write
+
+
+class Command(BaseCommand):
+    help = 'Переносит точку отсчёта оценок популярного на текущий момент; запускается по расписанию'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перенести, даже если с прошлого переноса не прошло TRENDING_REBASE_AFTER',
+        )
+
+    def handle(self, *args, **options):
+        with serialized_write():
+            started = trends.epoch()
+        if not options['force'] and timezone.now() - started < timedelta(seconds=settings.TRENDING_REBASE_AFTER):
+            self.stdout.write(f'Точка отсчёта {started:%Y-%m-%d %H:%M} ещё свежая, перенос не нужен')
+            return
+        removed = trends.rebase()
+        self.stdout.write(f'Точка отсчёта перенесена, удалено ничтожных оценок: {removed}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_comments, reconcile_users
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики постов, подписок и комментариев'
+
+    def handle(self, *args, **options):
+        users = reconcile_users(User.objects.all())
+        comments = reconcile_comments()
+        self.stdout.write(f'Исправлено счётчиков: пользователей {users}, постов {comments}')
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = 'Раскладывает по лентам посты авторов, опустившихся ниже порога раскладки; запускается по расписанию'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.TIMELINE_BATCH_SIZE, help='Подписчиков за одну транзакцию'
+        )
+
+    def handle(self, *args, **options):
+        count = timeline.refan_pending(batch_size=options['batch_size'])
+        self.stdout.write(f'Посты разложены по лентам подписчиков авторов: {count}')
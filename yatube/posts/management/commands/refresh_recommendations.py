@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации «на кого подписаться» по графу подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать всех пользователей, а не только тех, чьи подписки изменились',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['full']:
+            count = recommendations.refresh(batch_size=options['batch_size'])
+        else:
+            count = recommendations.refresh_changed(batch_size=options['batch_size'])
+        self.stdout.write(f'Пересчитаны рекомендации пользователей: {count}')
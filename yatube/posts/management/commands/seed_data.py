@@ -0,0 +1,185 @@
+import bisect
+import datetime as dt
+import io
+import itertools
+import random
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from posts import transfer
+from posts.models import Comment, Follow, Group, Post, User, UserStats
+from posts.storage import blob_storage
+from posts.utils import explicit_dates
+
+WORDS = (
+    'день ночь город море лес река дорога дом окно кот собака птица книга письмо '
+    'утро вечер снег дождь солнце ветер друг встреча работа отпуск поезд самолёт '
+    'кофе чай музыка фильм песня парк мост улица небо звезда осень весна лето зима'
+).split()
+SEED_IMAGES = 8
+START = dt.datetime(2021, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def zipf_weights(size, alpha):
+    """Накопленные веса степенного распределения: ранг i выбирается с весом 1 / (i + 1) ** alpha"""
+    return list(itertools.accumulate(1 / (rank + 1) ** alpha for rank in range(size)))
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу воспроизводимым набором данных: пользователи, подписки, группы, посты, комментарии'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--following', type=int, default=20, help='Среднее число подписок пользователя')
+        parser.add_argument('--alpha', type=float, default=1.0, help='Показатель степенного распределения популярности')
+        parser.add_argument('--images', type=float, default=0.1, help='Доля постов с изображением')
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней распределены посты')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--prefix', default='seed_', help='Префикс имён пользователей и slug групп')
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее созданный набор с тем же префиксом')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = prefix = options['prefix']
+        seeded_users = User.objects.filter(username__startswith=prefix)
+        if seeded_users.exists():
+            if not options['clear']:
+                raise CommandError(f'Пользователи с префиксом {prefix!r} уже есть, добавьте --clear')
+            seeded_users.delete()
+            Group.objects.filter(slug__startswith=prefix).delete()
+
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'], options['password'])
+            group_ids = self.create_groups(prefix, options['groups'])
+            popularity = zipf_weights(len(user_ids), options['alpha'])
+            follows = self.create_follows(user_ids, popularity, options['following'])
+            post_ids, post_authors = self.create_posts(user_ids, group_ids, popularity, options)
+            self.create_stats(user_ids, follows, post_authors)
+            # Всё, что при обычной записи поддерживают сигналы, в том числе индекс подписок процессов
+            transfer.rebuild_derived()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: пользователей {len(user_ids)}, групп {len(group_ids)}, подписок {len(follows)}, '
+            f'постов {len(post_ids)}, комментариев {options["comments"] if post_ids else 0}'
+        ))
+
+    def bulk_create(self, model, objects):
+        for start in range(0, len(objects), self.batch_size):
+            model.objects.bulk_create(objects[start:start + self.batch_size])
+
+    def create_users(self, prefix, count, password):
+        # Хэш пароля дорогой, поэтому он считается один раз на всех
+        password = make_password(password)
+        self.bulk_create(User, [
+            User(username=f'{prefix}{number}', email=f'{prefix}{number}@example.com', password=password)
+            for number in range(count)
+        ])
+        ids = dict(User.objects.filter(username__startswith=prefix).values_list('username', 'id'))
+        # Ранг популярности = порядковый номер пользователя
+        return [ids[f'{prefix}{number}'] for number in range(count)]
+
+    def create_groups(self, prefix, count):
+        self.bulk_create(Group, [
+            Group(title=f'Группа {number}', slug=f'{prefix}{number}', description=self.sentence(5, 20))
+            for number in range(count)
+        ])
+        ids = dict(Group.objects.filter(slug__startswith=prefix).values_list('slug', 'id'))
+        return [ids[f'{prefix}{number}'] for number in range(count)]
+
+    def create_follows(self, user_ids, popularity, following):
+        follows = []
+        for user_id in user_ids:
+            # Число подписок тоже с тяжёлым хвостом: у распределения Парето(2) среднее равно 2
+            wanted = min(len(user_ids) - 1, int(self.rng.paretovariate(2.0) * following / 2))
+            authors = set()
+            for _ in range(wanted * 4):
+                if len(authors) >= wanted:
+                    break
+                author_id = self.choose(user_ids, popularity)
+                if author_id != user_id:
+                    authors.add(author_id)
+            follows.extend((user_id, author_id) for author_id in sorted(authors))
+        self.bulk_create(Follow, [Follow(user_id=user_id, author_id=author_id) for user_id, author_id in follows])
+        return follows
+
+    def create_posts(self, user_ids, group_ids, popularity, options):
+        count = options['posts']
+        authors = [self.choose(user_ids, popularity) for _ in range(count)]
+        span = options['days'] * 86400
+        dates = sorted(START + dt.timedelta(seconds=self.rng.randrange(span)) for _ in range(count))
+        group_popularity = zipf_weights(len(group_ids), options['alpha'])
+        groups = [
+            self.choose(group_ids, group_popularity) if group_ids and self.rng.random() < 0.7 else None
+            for _ in range(count)
+        ]
+        images = self.seed_images() if options['images'] > 0 else []
+        # Комментарии достаются в основном постам популярных авторов
+        post_popularity = list(itertools.accumulate(self.author_weights(user_ids, authors, options['alpha'])))
+        commented = [self.choose(range(count), post_popularity) for _ in range(options['comments'])] if count else []
+        comments_count = Counter(commented)
+        posts = [
+            Post(
+                text=self.sentence(5, 60), author_id=author_id, group_id=group_id, pub_date=pub_date,
+                image=self.rng.choice(images) if images and self.rng.random() < options['images'] else None,
+                comments_count=comments_count[index],
+            )
+            for index, (author_id, group_id, pub_date) in enumerate(zip(authors, groups, dates))
+        ]
+        with explicit_dates(Post, 'pub_date'):
+            self.bulk_create(Post, posts)
+        post_ids = list(Post.objects.filter(author__username__startswith=self.prefix).order_by('id').values_list('id', flat=True))
+
+        comments = []
+        for index in commented:
+            created = min(dates[index] + dt.timedelta(seconds=self.rng.randrange(2 * 86400)), timezone.now())
+            comments.append(Comment(
+                post_id=post_ids[index], author_id=self.rng.choice(user_ids), text=self.sentence(2, 30), created=created
+            ))
+        with explicit_dates(Comment, 'created'):
+            self.bulk_create(Comment, comments)
+        return post_ids, authors
+
+    def author_weights(self, user_ids, authors, alpha):
+        rank = {user_id: position for position, user_id in enumerate(user_ids)}
+        return [1 / (rank[author_id] + 1) ** alpha for author_id in authors]
+
+    def create_stats(self, user_ids, follows, post_authors):
+        posts = Counter(post_authors)
+        followers = Counter(author_id for _, author_id in follows)
+        following = Counter(user_id for user_id, _ in follows)
+        self.bulk_create(UserStats, [
+            UserStats(
+                user_id=user_id, posts_count=posts[user_id],
+                followers_count=followers[user_id], following_count=following[user_id],
+            )
+            for user_id in user_ids
+        ])
+
+    def seed_images(self):
+        names = []
+        for number in range(SEED_IMAGES):
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            buffer = io.BytesIO()
+            Image.new('RGB', (1200, 800), color).save(buffer, 'JPEG')
+            # Хранилище по содержимому: при повторном запуске та же картинка ляжет в тот же файл
+            names.append(blob_storage.save(f'posts/seed/{number}.jpg', ContentFile(buffer.getvalue())))
+        return names
+
+    def choose(self, population, cum_weights):
+        return population[bisect.bisect(cum_weights, self.rng.random() * cum_weights[-1])]
+
+    def sentence(self, shortest, longest):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(shortest, longest))).capitalize()
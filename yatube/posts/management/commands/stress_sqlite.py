@@ -0,0 +1,126 @@
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Post, User
+
+CLIENT_ADDRESS = '192.0.2.1'
+MARK = 'stress:'
+
+
+class Command(BaseCommand):
+    help = ('Нагружает SQLite одновременными публикациями, комментариями, подписками и чтением лент '
+            'и считает ошибки «database is locked»')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--baseline', action='store_true',
+                            help='Без WAL, настроек соединения и очереди записи — как было до них')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные посты и комментарии')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Команда проверяет только SQLite')
+        users = list(User.objects.order_by('id')[:options['writers'] + options['readers'] + 1])
+        if len(users) < 2:
+            raise CommandError('В базе мало пользователей, сначала выполните seed_data')
+        profile = {'SQLITE_PRAGMAS': {'journal_mode': 'DELETE'}, 'SQLITE_SERIALIZE_WRITES': False} if options['baseline'] else {}
+
+        with override_settings(**profile):
+            # Новые настройки применяются к новым соединениям, режим журнала сохраняется в файле базы
+            connections.close_all()
+            connections['default'].ensure_connection()
+            results = self.run(users, options)
+            connections.close_all()
+
+        if not options['keep']:
+            Comment.objects.filter(text__startswith=MARK).delete()
+            Post.objects.filter(text__startswith=MARK).delete()
+
+        self.stdout.write(f'{"профиль":<10} {"baseline" if options["baseline"] else "tuned"}')
+        for kind in ('write', 'read'):
+            timings = sorted(results[kind])
+            if not timings:
+                continue
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(
+                f'{kind:<10} запросов {len(timings):>6}  p50 {statistics.median(timings) * 1000:>8.1f} мс  '
+                f'p99 {p99 * 1000:>8.1f} мс'
+            )
+        errors = results['errors']
+        self.stdout.write(f'ошибок «database is locked»: {errors["locked"]}, других: {errors["other"]}')
+
+    def client(self, user):
+        client = Client(REMOTE_ADDR=CLIENT_ADDRESS, HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        client.force_login(user)
+        return client
+
+    def run(self, users, options):
+        results = {'write': [], 'read': [], 'errors': Counter()}
+        lock = threading.Lock()
+        post_ids = list(Post.objects.order_by('-id').values_list('id', flat=True)[:50])
+        authors = [user.username for user in users]
+        deadline = time.monotonic() + options['seconds']
+
+        def request(kind, call, *args, **kwargs):
+            began = time.perf_counter()
+            try:
+                response = call(*args, **kwargs)
+                error = None if response.status_code < 500 else 'other'
+            except OperationalError as exception:
+                error = 'locked' if 'locked' in str(exception) else 'other'
+            with lock:
+                results[kind].append(time.perf_counter() - began)
+                if error:
+                    results['errors'][error] += 1
+
+        def writer(user, number):
+            client = self.client(user)
+            randomizer = random.Random(number)
+            start.wait()
+            step = 0
+            while time.monotonic() < deadline:
+                step += 1
+                action = step % 3
+                if action == 0:
+                    request('write', client.post, reverse('new_post'), {'text': f'{MARK}{user.username} {step}'})
+                elif action == 1 and post_ids:
+                    post = Post.objects.select_related('author').filter(pk=randomizer.choice(post_ids)).first()
+                    if post is not None:
+                        url = reverse('add_comment', kwargs={'username': post.author.username, 'post_id': post.id})
+                        request('write', client.post, url, {'text': f'{MARK}{step}'})
+                else:
+                    author = randomizer.choice(authors)
+                    request('write', client.get, reverse('profile_follow', kwargs={'username': author}))
+                    request('write', client.get, reverse('profile_unfollow', kwargs={'username': author}))
+            connections.close_all()
+
+        def reader(user):
+            client = self.client(user)
+            start.wait()
+            while time.monotonic() < deadline:
+                request('read', client.get, reverse('follow_index'))
+                request('read', client.get, reverse('profile', kwargs={'username': user.username}))
+            connections.close_all()
+
+        writers = users[:options['writers']]
+        readers = users[options['writers']:options['writers'] + options['readers']] or users[:options['readers']]
+        threads = [threading.Thread(target=writer, args=(user, number)) for number, user in enumerate(writers)]
+        threads += [threading.Thread(target=reader, args=(user,)) for user in readers]
+        start = threading.Barrier(len(threads))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+
+from posts.models import Post
+from posts.thumbnails import mark_ready
+from posts.workers import generate_thumbnail, process_pool
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры карточек для всех постов с изображениями в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.POSTS_THUMBNAIL_WORKERS, 1))
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        # Одинаковые картинки лежат в одном файле (posts.storage): миниатюра делается по одному посту на файл
+        images = posts.values('image').annotate(post_id=Min('id')).order_by('image')
+        last_image, total = '', 0
+        with process_pool(options['workers']) as pool:
+            while True:
+                # Пачки по имени, а не iterator(): открытое чтение SQLite мешало бы воркерам писать
+                batch = list(images.filter(image__gt=last_image).values_list('image', 'post_id')[:options['batch_size']])
+                if not batch:
+                    break
+                post_ids = [post_id for _, post_id in batch]
+                ready = [name for (name, _), done in zip(batch, pool.map(generate_thumbnail, post_ids, chunksize=16)) if done]
+                mark_ready(list(posts.filter(image__in=ready).values_list('id', flat=True)))
+                last_image, total = batch[-1][0], total + len(ready)
+                self.stdout.write(f'Готово миниатюр: {total}')
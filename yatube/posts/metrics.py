@@ -0,0 +1,232 @@
+"""Лёгкие метрики запросов для продакшена.
+
+MetricsMiddleware замеряет полное время ответа каждого запроса, а у выборки
+запросов (доля METRICS_SAMPLE_RATE) ещё число и время SQL-запросов, время
+рендера шаблонов и попадания в кэш страниц и карточек. Значения копятся в
+гистограммах внутри процесса с ключом по имени URL и отдаются на /metrics в
+текстовом формате Prometheus; у выбранных запросов есть заголовок Server-Timing.
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends import django as django_backend
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_sample = ContextVar('metrics_sample', default=None)
+
+
+class Sample:
+    """Замеры одного выбранного запроса"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.cache = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Гистограммы и счётчики процесса; метка view — имя URL"""
+
+    HISTOGRAMS = {
+        'request_duration_seconds': ('Полное время ответа', LATENCY_BUCKETS),
+        'db_duration_seconds': ('Время SQL-запросов (выборка)', LATENCY_BUCKETS),
+        'template_duration_seconds': ('Время рендера шаблонов (выборка)', LATENCY_BUCKETS),
+        'db_queries': ('Число SQL-запросов (выборка)', QUERY_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name in self.HISTOGRAMS}
+        self.cache = {}
+        self.gauges = {}
+
+    def register_gauge(self, name, description, func):
+        """Показатель, значение которого func() вычисляет в момент выгрузки"""
+        self.gauges[name] = (description, func)
+
+    def observe(self, name, view, value):
+        with self.lock:
+            histogram = self.histograms[name].get(view)
+            if histogram is None:
+                histogram = self.histograms[name][view] = Histogram(self.HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def count_cache(self, view, events):
+        with self.lock:
+            for (kind, result), value in events.items():
+                key = (view, kind, result)
+                self.cache[key] = self.cache.get(key, 0) + value
+
+    def export(self, prefix='yatube'):
+        lines = []
+        with self.lock:
+            for name, (description, _) in self.HISTOGRAMS.items():
+                metric = f'{prefix}_{name}'
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+                for view, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{view="{view}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{view}"}} {histogram.count}')
+            metric = f'{prefix}_cache_requests_total'
+            lines += [f'# HELP {metric} Обращения к кэшу страниц и карточек (выборка)', f'# TYPE {metric} counter']
+            for (view, kind, result), value in sorted(self.cache.items()):
+                lines.append(f'{metric}{{view="{view}",cache="{kind}",result="{result}"}} {value}')
+        for name, (description, func) in sorted(self.gauges.items()):
+            metric = f'{prefix}_{name}'
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} gauge', f'{metric} {func()}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def count_cache(kind, hits=0, misses=0):
+    """Отмечает попадания и промахи кэша kind в текущем выбранном запросе"""
+    sample = _sample.get()
+    if sample is None:
+        return
+    for result, value in (('hit', hits), ('miss', misses)):
+        if value:
+            sample.cache[kind, result] = sample.cache.get((kind, result), 0) + value
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        sample = _sample.get()
+        # Вложенные рендеры (карточки внутри ленты) уже входят во время внешнего
+        if sample is None or sample.rendering:
+            return super().render(context, request)
+        sample.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template_time += time.perf_counter() - start
+            sample.rendering = False
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Бэкенд шаблонов Django, который замеряет рендер в выбранных запросах"""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+def server_timing(sample, total):
+    cache = ' '.join(f'{kind}-{result}={value}' for (kind, result), value in sorted(sample.cache.items()))
+    parts = [
+        f'db;dur={sample.db_time * 1000:.1f};desc="{sample.queries} queries"',
+        f'tpl;dur={sample.template_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ]
+    if cache:
+        parts.append(f'cache;desc="{cache}"')
+    return ', '.join(parts)
+
+
+@contextmanager
+def instrument_connections():
+    """Считает SQL-запросы потока в текущий выбранный запрос (если он выбран)"""
+    sample = _sample.get()
+    with ExitStack() as stack:
+        if sample is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sample))
+        yield
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Как у django.utils.deprecation.MiddlewareMixin: под ASGI цепочка остаётся асинхронной
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        sample = Sample() if random.random() < settings.METRICS_SAMPLE_RATE else None
+        token = _sample.set(sample)
+        start = time.perf_counter()
+        try:
+            with instrument_connections():
+                response = self.get_response(request)
+        finally:
+            _sample.reset(token)
+        return self.finish(request, sample, start, response)
+
+    async def __acall__(self, request):
+        # Запросы к бд асинхронных вьюх идут в других потоках, их учитывает instrument_connections там
+        sample = Sample() if random.random() < settings.METRICS_SAMPLE_RATE else None
+        token = _sample.set(sample)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _sample.reset(token)
+        return self.finish(request, sample, start, response)
+
+    def finish(self, request, sample, start, response):
+        total = time.perf_counter() - start
+        view = getattr(request.resolver_match, 'url_name', None) or 'unresolved'
+        registry.observe('request_duration_seconds', view, total)
+        if sample is not None:
+            registry.observe('db_duration_seconds', view, sample.db_time)
+            registry.observe('template_duration_seconds', view, sample.template_time)
+            registry.observe('db_queries', view, sample.queries)
+            registry.count_cache(view, sample.cache)
+            response['Server-Timing'] = server_timing(sample, total)
+        return response
+
+
+def metrics_view(request):
+    allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    if not allowed and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.7 on 2026-10-18 04:24
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def count_refs(apps, schema_editor):
+    # Файлы, загруженные до хранилища по содержимому, лежат под старыми именами, но считаются так же
+    Blob = apps.get_model('posts', 'Blob')
+    refs = Counter()
+    for model in ('Post', 'ArchivedPost'):
+        images = apps.get_model('posts', model).objects.exclude(image='').exclude(image=None)
+        refs.update(dict(images.values_list('image').annotate(total=Count('pk')).order_by()))
+    Blob.objects.bulk_create([Blob(name=name, refs=total) for name, total in refs.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='archivedpost',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.RunPython(count_refs, migrations.RunPython.noop),
+    ]
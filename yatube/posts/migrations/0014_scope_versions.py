@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:10
+
+import time
+
+from django.db import migrations, models
+
+
+def seed_site(apps, schema_editor):
+    # Кэш страниц, собранный до миграции, сверяется с новыми отметками и пересчитывается
+    apps.get_model('posts', 'ScopeVersion').objects.create(scope='site', changed=time.time_ns())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScopeVersion',
+            fields=[
+                ('scope', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('changed', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(seed_site, migrations.RunPython.noop),
+    ]
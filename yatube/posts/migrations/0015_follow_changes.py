@@ -0,0 +1,22 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_scope_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.BooleanField(null=True)),
+                ('user_id', models.IntegerField(default=0)),
+                ('author_id', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_celebrities(apps, schema_editor):
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(followers_count__gt=settings.TIMELINE_FANOUT_LIMIT).update(celebrity=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_follow_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='celebrity',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TimelineRefan',
+            fields=[
+                ('author_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('requested', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
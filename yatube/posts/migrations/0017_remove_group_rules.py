@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_timeline_refan'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='group',
+            name='rules',
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import blob_storage
+
 
 User = get_user_model()
 
@@ -14,6 +16,12 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        """Посты для ленты: автор и группа одним запросом, число комментариев из счётчика"""
+        return self.select_related('author', 'group').order_by('-pub_date')
+
+
 class Post(models.Model):
     text = models.TextField(blank=True)
     pub_date = models.DateTimeField('date_published', auto_now_add=True)
@@ -21,7 +29,19 @@ class Post(models.Model):
     group = models.ForeignKey(
         Group, on_delete=models.CASCADE, related_name='group_posts', blank=True, null=True
     )
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', storage=blob_storage, blank=True, null=True)
+    comments_count = models.IntegerField(default=0)
+    # Версия отрендеренной карточки поста (posts.fragments)
+    version = models.IntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='post_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'], name='post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'], name='post_group_date_idx'),
+        ]
 
     def __str__(self):
         return self.text
@@ -33,6 +53,11 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'], name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return self.text
 
@@ -40,3 +65,155 @@ class Comment(models.Model):
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follower')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'], name='unique_follow'),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, поддерживаются сигналами (posts.counters)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    posts_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    # Посты автора подмешиваются в ленты при чтении, а не раскладываются (posts.timeline)
+    celebrity = models.BooleanField(default=False)
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост автора, разложенный по подписчикам"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date'], name='timeline_user_date_idx'),
+        ]
+
+
+class TimelineRefan(models.Model):
+    """Авторы, опустившиеся ниже порога раскладки, чьи посты ждут раскладки по лентам (команда refan_timelines).
+
+    Без внешнего ключа, как RecommendationRefresh.
+    """
+    author_id = models.IntegerField(primary_key=True)
+    requested = models.DateTimeField(auto_now=True)
+
+
+class Recommendation(models.Model):
+    """Предрассчитанные рекомендации «на кого подписаться» (posts.recommendations)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'], name='unique_recommendation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='recommendation_user_score_idx'),
+        ]
+
+
+class RecommendationRefresh(models.Model):
+    """Пользователи, чьи подписки изменились после последнего расчёта рекомендаций.
+
+    Без внешнего ключа: отписки при каскадном удалении пользователя тоже пишут сюда.
+    """
+    user_id = models.IntegerField(primary_key=True)
+    changed = models.DateTimeField(auto_now=True)
+
+
+class PostTrend(models.Model):
+    """Затухающая оценка популярности поста (posts.trends)"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='post_trend_score_idx'),
+        ]
+
+
+class GroupTrend(models.Model):
+    """Затухающая оценка активности группы (posts.trends)"""
+    group = models.OneToOneField(Group, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='group_trend_score_idx'),
+        ]
+
+
+class TrendEpoch(models.Model):
+    """Момент, от которого отсчитываются оценки популярности; единственная строка"""
+    started = models.DateTimeField()
+
+
+class ArchivedPost(models.Model):
+    """Пост, перенесённый в холодное хранение (posts.archive); id тот же, что был у Post"""
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField(blank=True)
+    pub_date = models.DateTimeField('date_published')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_posts')
+    group = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name='archived_posts', blank=True, null=True
+    )
+    image = models.ImageField(upload_to='posts/', storage=blob_storage, blank=True, null=True)
+    comments_count = models.IntegerField(default=0)
+    version = models.IntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='archived_post_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'], name='archived_post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'], name='archived_post_group_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.text
+
+
+class ArchivedComment(models.Model):
+    """Комментарий к посту из холодного хранения"""
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_comments')
+    text = models.TextField()
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'], name='archived_comment_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.text
+
+
+class Blob(models.Model):
+    """Файл изображения в хранилище по содержимому и число постов, которые на него ссылаются (posts.blobs)"""
+    name = models.CharField(max_length=255, primary_key=True)
+    refs = models.IntegerField(default=0)
+
+
+class ScopeVersion(models.Model):
+    """Отметка последнего изменения области кэша страниц (posts.page_cache)"""
+    scope = models.CharField(max_length=200, primary_key=True)
+    changed = models.BigIntegerField()
+
+
+class FollowChange(models.Model):
+    """Журнал подписок и отписок для индексов процессов (posts.follow_graph); created=None — загрузить заново"""
+    created = models.BooleanField(null=True)
+    user_id = models.IntegerField(default=0)
+    author_id = models.IntegerField(default=0)
@@ -0,0 +1,182 @@
+"""Кэш целых страниц для анонимных посетителей.
+
+Вместо TTL страница сбрасывается событиями: каждой странице соответствуют
+«области» (вся лента, группа, профиль автора, пост, весь сайт), у каждой
+области в базе (ScopeVersion) хранится отметка времени последнего изменения.
+Сигналы Post, Comment, Follow и Group обновляют отметки (touch) в той же
+транзакции, что и сами данные, поэтому все процессы видят новую отметку ровно
+с коммитом, а закэшированная страница с устаревшими отметками перестаёт
+совпадать. В кэше лежат только страницы: его вытеснение или отдельный кэш у
+каждого процесса стоят лишних пересчётов, но не устаревших ответов. Пересчитывает страницу один запрос: пока он
+держит блокировку, остальные получают прежнюю версию (stale-while-revalidate),
+а если прежней нет — до PAGE_CACHE_WAIT секунд ждут, пока он положит новую.
+"""
+import datetime as dt
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.http import HttpResponse
+
+from . import metrics
+from .models import ScopeVersion
+
+PAGE_KEY = 'page:{}'
+# Как часто запрос без прежней версии страницы проверяет, не готова ли она
+WAIT_POLL_INTERVAL = 0.02
+# Область, от которой зависит каждая страница: её сбрасывают изменения групп
+# (их названия есть в карточках на всех лентах) и массовые операции
+SITE = 'site'
+
+
+def generations(scopes, request=None):
+    """Отметки изменения областей одним запросом; у ещё не менявшихся областей — 0.
+
+    С request отметки запоминаются на время запроса: ETag, Last-Modified и
+    кэш страницы сверяются с одной и той же версией.
+    """
+    known = getattr(request, '_page_generations', {})
+    missing = [scope for scope in scopes if scope not in known]
+    if missing:
+        known.update(dict.fromkeys(missing, 0))
+        known.update(ScopeVersion.objects.filter(scope__in=missing).values_list('scope', 'changed'))
+        if request is not None:
+            request._page_generations = known
+    return {scope: known[scope] for scope in scopes}
+
+
+def touch(*scopes):
+    """Сдвигает отметки областей; вызывается внутри транзакции, которая меняет данные"""
+    scopes = set(scopes)
+    now = time.time_ns()
+    # Часы разных процессов могут расходиться, отметка при этом всё равно растёт
+    updated = ScopeVersion.objects.filter(scope__in=scopes).update(changed=Greatest(F('changed') + 1, Value(now)))
+    if updated < len(scopes):
+        ScopeVersion.objects.bulk_create(
+            [ScopeVersion(scope=scope, changed=now) for scope in scopes], ignore_conflicts=True
+        )
+
+
+def recommendations_scope(user_id):
+    """Область блока «на кого подписаться» пользователя (posts.recommendations)"""
+    return f'recommendations:{user_id}'
+
+
+def post_scopes(post, group_slug=None):
+    scopes = ['index', f'profile:{post.author.username}', f'post:{post.pk}']
+    if post.group_id:
+        scopes.append(f'group:{post.group.slug}')
+    if group_slug:
+        scopes.append(f'group:{group_slug}')
+    return scopes
+
+
+def etag_func(scopes, per_user=True):
+    """etag_func для django.views.decorators.http.condition по отметкам областей страницы.
+
+    В ETag входят адрес с параметрами и, для страниц с разметкой под пользователя, его id
+    и отметка его рекомендаций.
+    """
+    def etag(request, **kwargs):
+        page_scopes = scopes(**kwargs)
+        if per_user and request.user.is_authenticated:
+            page_scopes = [*page_scopes, recommendations_scope(request.user.id)]
+        parts = [request.get_full_path(), *map(str, generations(page_scopes, request).values())]
+        if per_user:
+            parts.append(str(request.user.id))
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()
+    return etag
+
+
+def last_modified_func(scopes):
+    """last_modified_func для condition: время последнего изменения областей страницы.
+
+    Только для анонимов: после входа или выхода If-Modified-Since не должен вернуть
+    чужую версию страницы, для авторизованных остаётся ETag с id пользователя.
+    """
+    def last_modified(request, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        changed = max(generations(scopes(**kwargs), request).values())
+        return dt.datetime.fromtimestamp(changed / 1e9, tz=dt.timezone.utc)
+    return last_modified
+
+
+def _response(entry):
+    _, content, content_type = entry
+    return HttpResponse(content, content_type=content_type)
+
+
+class PageSlot:
+    """Место страницы в кэше: ключ, версия областей и признак взятой блокировки пересчёта"""
+
+    def __init__(self, key, version, locked):
+        self.key = key
+        self.version = version
+        self.locked = locked
+
+    def store(self, response):
+        if response.status_code == 200 and not response.streaming:
+            cache.set(self.key, (self.version, response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+
+    def release(self):
+        if self.locked:
+            cache.delete(f'{self.key}:lock')
+
+
+def _wait_for(key):
+    """Запись, которую положил запрос с блокировкой, либо None, если он не успел или не смог"""
+    deadline = time.monotonic() + settings.PAGE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(f'{key}:lock') is None:
+            # Блокировку сняли, а страницы нет: например, ответ был не 200
+            return None
+    return None
+
+
+def lookup(request, scopes):
+    """Возвращает (закэшированный ответ, None) либо (None, PageSlot), если страницу надо пересчитать"""
+    version = tuple(generations(scopes, request).values())
+    key = PAGE_KEY.format(hashlib.md5(request.get_full_path().encode()).hexdigest())
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        metrics.count_cache('page', hits=1)
+        return _response(entry), None
+    locked = cache.add(f'{key}:lock', 1, settings.PAGE_CACHE_LOCK_TIMEOUT)
+    if entry is None and not locked:
+        # Прежней версии нет, а страницу уже считает другой запрос: ждём её вместо своего пересчёта
+        entry = _wait_for(key)
+    if entry is not None and not locked:
+        # Страницу уже пересчитывает другой запрос, отдаём прежнюю версию
+        metrics.count_cache('page', hits=1)
+        return _response(entry), None
+    metrics.count_cache('page', misses=1)
+    return None, PageSlot(key, version, locked)
+
+
+def anonymous_page_cache(scopes):
+    """Кэширует GET-ответ вьюхи для анонимов; ``scopes(**kwargs)`` — области страницы"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            cached, slot = lookup(request, scopes(**kwargs))
+            if cached is not None:
+                return cached
+            try:
+                response = view(request, *args, **kwargs)
+                slot.store(response)
+            finally:
+                slot.release()
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,169 @@
+"""Рекомендации «на кого подписаться».
+
+Граф подписок целиком загружается в память как две CSR-матрицы смежности на
+массивах numpy (кто на кого подписан и кто на кого подписан в обратную
+сторону), индексы строк — плотные номера пользователей. Для пользователя
+кандидаты набираются из двух источников:
+
+* друзья друзей — авторы, на которых подписаны его авторы;
+* совместные подписки — авторы, на которых подписаны пользователи с
+  наибольшим пересечением подписок с ним (вес — размер пересечения).
+
+Лучшие RECOMMENDATIONS_PER_USER кандидатов сохраняются в Recommendation,
+страницы читают готовую таблицу. Подписка и отписка помечают пользователя в
+RecommendationRefresh, и команда refresh_recommendations без --full
+пересчитывает только их.
+"""
+import itertools
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import page_cache
+from .models import Follow, Recommendation, RecommendationRefresh, User
+
+FRIENDS_OF_FRIENDS_WEIGHT = 1.0
+CO_FOLLOW_WEIGHT = 0.5
+# Сколько самых похожих пользователей учитывается для совместных подписок
+SIMILAR_USERS = 50
+
+
+class FollowGraph:
+    """Граф подписок в CSR-виде: out — подписки пользователя, inc — его подписчики"""
+
+    def __init__(self, user_ids, pairs):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        size = len(self.user_ids)
+        users = np.searchsorted(self.user_ids, pairs[:, 0])
+        authors = np.searchsorted(self.user_ids, pairs[:, 1])
+        self.out_ptr, self.out = self._csr(users, authors, size)
+        self.inc_ptr, self.inc = self._csr(authors, users, size)
+
+    @classmethod
+    def load(cls):
+        user_ids = np.fromiter(User.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64)
+        follows = Follow.objects.values_list('user_id', 'author_id').iterator()
+        pairs = np.fromiter(itertools.chain.from_iterable(follows), dtype=np.int64).reshape(-1, 2)
+        return cls(user_ids, pairs)
+
+    @staticmethod
+    def _csr(rows, columns, size):
+        order = np.lexsort((columns, rows))
+        pointers = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=pointers[1:])
+        return pointers, columns[order]
+
+    @staticmethod
+    def gather(pointers, values, rows, weights=None):
+        """Склеивает строки rows матрицы; веса строк повторяются для каждого её элемента"""
+        starts, lengths = pointers[rows], pointers[rows + 1] - pointers[rows]
+        total = lengths.sum()
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        gathered = values[offsets + np.arange(total)]
+        if weights is None:
+            return gathered, None
+        return gathered, np.repeat(weights, lengths)
+
+    def index(self, user_id):
+        return int(np.searchsorted(self.user_ids, user_id))
+
+    @cached_property
+    def in_degree(self):
+        return np.diff(self.inc_ptr)
+
+    @cached_property
+    def by_popularity(self):
+        """Авторы с подписчиками по убыванию их числа; сортируется один раз на граф"""
+        order = np.argsort(-self.in_degree, kind='stable')
+        return order[self.in_degree[order] > 0]
+
+    def popular(self, limit):
+        """Самые популярные авторы и их число подписчиков в долях от наибольшего"""
+        top = self.by_popularity[:limit]
+        peak = self.in_degree[self.by_popularity[0]] if len(self.by_popularity) else 1
+        return top, self.in_degree[top].astype(float) / peak
+
+    def recommend(self, user, limit):
+        """Плотные номера рекомендованных авторов и их оценки, по убыванию оценки"""
+        following = self.out[self.out_ptr[user]:self.out_ptr[user + 1]]
+        if not len(following):
+            # Новому пользователю без подписок — самые популярные авторы
+            top, scores = self.popular(limit + 1)
+            keep = top != user
+            return top[keep][:limit], scores[keep][:limit]
+
+        friends, _ = self.gather(self.out_ptr, self.out, following)
+        co_followers, overlap = np.unique(self.gather(self.inc_ptr, self.inc, following)[0], return_counts=True)
+        keep = co_followers != user
+        co_followers, overlap = co_followers[keep], overlap[keep]
+        if len(co_followers) > SIMILAR_USERS:
+            similar = np.argpartition(-overlap, SIMILAR_USERS)[:SIMILAR_USERS]
+            co_followers, overlap = co_followers[similar], overlap[similar]
+        co_followed, weights = self.gather(self.out_ptr, self.out, co_followers, overlap / len(following))
+
+        candidates = np.concatenate([friends, co_followed])
+        scores = np.concatenate([np.full(len(friends), FRIENDS_OF_FRIENDS_WEIGHT), CO_FOLLOW_WEIGHT * weights])
+        candidates, inverse = np.unique(candidates, return_inverse=True)
+        scores = np.bincount(inverse, weights=scores, minlength=len(candidates))
+        keep = ~np.isin(candidates, following) & (candidates != user)
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((candidates, -scores))
+        return candidates[order], scores[order]
+
+
+def refresh(user_ids=None, batch_size=500):
+    """Пересчитывает рекомендации пользователей (всех, если user_ids не задан); возвращает их число"""
+    started = timezone.now()
+    graph = FollowGraph.load()
+    if user_ids is None:
+        user_ids = graph.user_ids.tolist()
+    limit = settings.RECOMMENDATIONS_PER_USER
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        rows = []
+        for user_id in batch:
+            user = graph.index(user_id)
+            if user >= len(graph.user_ids) or graph.user_ids[user] != user_id:
+                # Пользователь удалён
+                continue
+            authors, scores = graph.recommend(user, limit)
+            rows.extend(
+                Recommendation(user_id=user_id, author_id=int(graph.user_ids[author]), score=float(score))
+                for author, score in zip(authors, scores)
+            )
+        with transaction.atomic():
+            Recommendation.objects.filter(user_id__in=batch).delete()
+            Recommendation.objects.bulk_create(rows)
+            RecommendationRefresh.objects.filter(user_id__in=batch, changed__lte=started).delete()
+            # Блок рекомендаций виден только самому пользователю: меняется ETag его страниц
+            page_cache.touch(*map(page_cache.recommendations_scope, batch))
+    return len(user_ids)
+
+
+def refresh_changed(batch_size=500):
+    """Пересчитывает рекомендации только тех, чьи подписки изменились"""
+    user_ids = list(RecommendationRefresh.objects.values_list('user_id', flat=True))
+    if not user_ids:
+        return 0
+    return refresh(user_ids, batch_size)
+
+
+def mark_changed(user_id):
+    RecommendationRefresh.objects.update_or_create(user_id=user_id)
+
+
+def who_to_follow(user, limit=5):
+    """Готовые рекомендации пользователя без авторов, на которых он уже подписался"""
+    return [
+        recommendation.author for recommendation in
+        Recommendation.objects.filter(user=user)
+        .exclude(author__following__user=user)
+        .select_related('author')
+        .order_by('-score')[:limit]
+    ]
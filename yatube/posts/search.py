@@ -0,0 +1,136 @@
+"""Полнотекстовый поиск по постам.
+
+На SQLite используется виртуальная таблица FTS5 posts_post_fts (rowid = id поста),
+которую сигналы синхронизируют с Post.text. Перенос в холодное хранение
+(posts.archive) id не меняет, поэтому архивные посты остаются в индексе и
+находятся наравне с горячими. Результаты ранжируются по bm25 и листаются
+курсором (ранг, id), поэтому глубина страницы не влияет на стоимость.
+На других СУБД поиск деградирует до icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import ArchivedPost, Post
+from .utils import decode_cursor, encode_cursor
+
+FTS_TABLE = 'posts_post_fts'
+HOT_TABLE = Post._meta.db_table
+ARCHIVE_TABLE = ArchivedPost._meta.db_table
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Каждое слово запроса ищется по префиксу: «прив мир» -> "прив"* "мир"*"""
+    words = re.findall(r'\w+', query)
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def index_post(post):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)', [post.pk, post.text])
+
+
+def unindex_post(post_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild():
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) '
+            f'SELECT id, text FROM {HOT_TABLE} UNION ALL SELECT id, text FROM {ARCHIVE_TABLE}'
+        )
+
+
+def matching(queryset, query):
+    """Фильтр queryset постов по поисковому запросу (без ранжирования)"""
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if not available():
+        return queryset.filter(text__icontains=query)
+    return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]))
+
+
+def _parse_cursor(token, size):
+    values = decode_cursor(token) if token else None
+    if values is None or len(values) != size + 1:
+        return None, 0
+    try:
+        return values[:size], int(values[-1])
+    except (TypeError, ValueError):
+        return None, 0
+
+
+def search(query, group=None, author=None, after=None, limit=10):
+    """Возвращает (посты страницы, номер страницы, курсор следующей страницы либо None)"""
+    expression = match_expression(query)
+    if not expression:
+        return [], 1, None
+    if not available():
+        return _search_fallback(query, group, author, after, limit)
+    # Пост лежит либо в горячей таблице, либо в архиве: оба join'а — по первичному ключу
+    sql = [
+        f'SELECT {FTS_TABLE}.rowid, bm25({FTS_TABLE}) FROM {FTS_TABLE}',
+        f'LEFT JOIN {HOT_TABLE} hot ON hot.id = {FTS_TABLE}.rowid',
+        f'LEFT JOIN {ARCHIVE_TABLE} cold ON cold.id = {FTS_TABLE}.rowid',
+        f'WHERE {FTS_TABLE} MATCH %s',
+    ]
+    params = [expression]
+    if group is not None:
+        sql.append('AND COALESCE(hot.group_id, cold.group_id) = %s')
+        params.append(group.pk)
+    if author is not None:
+        sql.append('AND COALESCE(hot.author_id, cold.author_id) = %s')
+        params.append(author.pk)
+    cursor_values, number = _parse_cursor(after, 2)
+    if cursor_values:
+        post_id, rank = cursor_values
+        sql.append(f'AND (bm25({FTS_TABLE}) > %s OR (bm25({FTS_TABLE}) = %s AND {FTS_TABLE}.rowid > %s))')
+        params.extend([rank, rank, post_id])
+    sql.append(f'ORDER BY bm25({FTS_TABLE}), {FTS_TABLE}.rowid LIMIT %s')
+    params.append(limit + 1)
+    with connection.cursor() as cursor:
+        cursor.execute(' '.join(sql), params)
+        ranked = cursor.fetchall()
+    number += 1
+    next_cursor = encode_cursor([*ranked[limit - 1], number]) if len(ranked) > limit else None
+    ranked = ranked[:limit]
+    ids = [post_id for post_id, _ in ranked]
+    posts = Post.objects.feed().in_bulk(ids)
+    missing = [post_id for post_id in ids if post_id not in posts]
+    if missing:
+        posts.update(ArchivedPost.objects.feed().in_bulk(missing))
+    return [posts[post_id] for post_id, _ in ranked if post_id in posts], number, next_cursor
+
+
+def _search_fallback(query, group, author, after, limit):
+    cursor_values, number = _parse_cursor(after, 1)
+    posts = []
+    for model in (Post, ArchivedPost):
+        queryset = model.objects.feed().filter(text__icontains=query).order_by('-id')
+        if group is not None:
+            queryset = queryset.filter(group=group)
+        if author is not None:
+            queryset = queryset.filter(author=author)
+        if cursor_values:
+            queryset = queryset.filter(id__lt=cursor_values[0])
+        posts.extend(queryset[:limit + 1])
+    posts = sorted(posts, key=lambda post: post.id, reverse=True)[:limit + 1]
+    number += 1
+    next_cursor = encode_cursor([posts[limit - 1].id, number]) if len(posts) > limit else None
+    return posts[:limit], number, next_cursor
@@ -0,0 +1,105 @@
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import blobs, counters, db_router, follow_graph, page_cache, recommendations, search, sqlite, timeline, trends
+from .models import ArchivedPost, Comment, Follow, Group, Post, User, UserStats
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    sqlite.configure(connection)
+    db_router.watch(connection)
+
+
+@receiver(post_save, sender=User)
+def create_stats(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def bump_post_version(sender, instance, **kwargs):
+    if not instance._state.adding and not kwargs.get('raw'):
+        instance.version = F('version') + 1
+        # Пост могли перенести в другую группу, её страницу тоже нужно сбросить;
+        # прежняя картинка теряет ссылку (posts.blobs)
+        instance._previous_group_slug, instance._previous_image = (
+            Post.objects.filter(pk=instance.pk).values_list('group__slug', 'image').first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_user(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+        trends.record_post(instance)
+        blobs.acquire(instance.image.name)
+    elif not kwargs.get('raw'):
+        instance.refresh_from_db(fields=['version'])
+        previous_image = getattr(instance, '_previous_image', None)
+        if (previous_image or None) != (instance.image.name or None):
+            blobs.acquire(instance.image.name)
+            blobs.release(previous_image)
+    search.index_post(instance)
+    page_cache.touch(*page_cache.post_scopes(instance, getattr(instance, '_previous_group_slug', None)))
+
+
+@receiver(post_delete, sender=Post)
+def forget_post(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, posts_count=-1)
+    page_cache.touch(*page_cache.post_scopes(instance))
+    search.unindex_post(instance.pk)
+    blobs.release(instance.image.name)
+
+
+@receiver(post_delete, sender=ArchivedPost)
+def forget_archived_post(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+    blobs.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_comments(instance.post_id, 1)
+        trends.record_comment(instance)
+    page_cache.touch(*page_cache.post_scopes(instance.post))
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+    page_cache.touch(*page_cache.post_scopes(instance.post))
+
+
+@receiver([post_save, post_delete], sender=Group)
+def touch_group(sender, instance, **kwargs):
+    page_cache.touch(page_cache.SITE, f'group:{instance.slug}')
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_user(instance.user_id, following_count=1)
+        counters.bump_user(instance.author_id, followers_count=1)
+        timeline.followed(instance.user_id, instance.author_id)
+        follow_graph.record(True, instance.user_id, instance.author_id)
+        recommendations.mark_changed(instance.user_id)
+    page_cache.touch(
+        f'profile:{instance.user.username}', f'profile:{instance.author.username}', f'timeline:{instance.user_id}'
+    )
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    counters.bump_user(instance.user_id, following_count=-1)
+    counters.bump_user(instance.author_id, followers_count=-1)
+    timeline.unfollowed(instance.user_id, instance.author_id)
+    follow_graph.record(False, instance.user_id, instance.author_id)
+    recommendations.mark_changed(instance.user_id)
+    page_cache.touch(
+        f'profile:{instance.user.username}', f'profile:{instance.author.username}', f'timeline:{instance.user_id}'
+    )
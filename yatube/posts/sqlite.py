@@ -0,0 +1,40 @@
+"""Настройка SQLite под одновременные чтения и запись.
+
+configure() выполняет SQLITE_PRAGMAS на каждом новом соединении: WAL позволяет
+читателям не ждать писателя, synchronous=NORMAL в WAL теряет при сбое питания
+только последние транзакции, но не портит базу, busy_timeout ждёт чужую запись
+вместо мгновенной ошибки.
+
+Ожидание не спасает транзакцию, которая начала читать, а потом пишет (например,
+pre_save поста читает его старую группу): если за это время записал другой,
+SQLite сразу отвечает «database is locked». serialized_write() выстраивает
+пишущие транзакции процесса в очередь на одной блокировке, так что писатель
+всегда один, а читатели в WAL его не ждут. Между процессами остаётся busy_timeout.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# RLock: обработчики on_commit внутри очереди тоже могут писать
+_write_lock = threading.RLock()
+
+
+def configure(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def serialized_write(using=DEFAULT_DB_ALIAS):
+    """transaction.atomic(), который для SQLite при SQLITE_SERIALIZE_WRITES ждёт своей очереди"""
+    if not settings.SQLITE_SERIALIZE_WRITES or connections[using].vendor != 'sqlite':
+        with transaction.atomic(using):
+            yield
+        return
+    with _write_lock, transaction.atomic(using):
+        yield
@@ -0,0 +1,54 @@
+"""Хранилище изображений постов по содержимому.
+
+Файл сохраняется под sha256 своего содержимого:
+<каталог upload_to>/<ab>/<cd>/<sha256><расширение>, поэтому одна и та же
+картинка, загруженная много раз, лежит на диске один раз, а миниатюры sorl,
+которые ключуются именем исходного файла, для неё тоже одни на все посты.
+Содержимое хешируется по ходу записи во временный файл кусками, целиком в
+памяти оно не держится. Сколько постов ссылается на файл, считает posts.blobs:
+удалять файл можно, только когда ссылок не осталось.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+INCOMING = '.incoming'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save, совпадение имён — это тот же файл
+        return name
+
+    def _save(self, name, content):
+        incoming = self.path(INCOMING)
+        os.makedirs(incoming, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=incoming)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(descriptor, 'wb') as output:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    output.write(chunk)
+            digest = digest.hexdigest()
+            extension = os.path.splitext(name)[1].lower()
+            name = posixpath.join(posixpath.dirname(name), digest[:2], digest[2:4], digest + extension)
+            path = self.path(name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                # Атомарно: одновременная загрузка того же файла запишет те же байты
+                os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return name
+
+
+blob_storage = ContentAddressedStorage()
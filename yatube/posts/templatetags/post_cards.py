@@ -0,0 +1,21 @@
+from django import template
+
+from posts import thumbnails
+from posts.fragments import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    return render_cards(posts, context['request'].user)
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    return render_cards([post], context['request'].user)
+
+
+@register.simple_tag
+def post_image(post):
+    return thumbnails.ready_image(post)
@@ -0,0 +1,14 @@
+from django import template
+
+from posts.recommendations import who_to_follow as recommended_authors
+
+register = template.Library()
+
+
+@register.inclusion_tag('who_to_follow.html', takes_context=True)
+def who_to_follow(context, limit=5):
+    if 'recommended_authors' in context:
+        # Асинхронная вьюха загрузила рекомендации заранее, параллельно с лентой
+        return {'authors': context['recommended_authors'][:limit]}
+    user = context['request'].user
+    return {'authors': recommended_authors(user, limit) if user.is_authenticated else []}
@@ -0,0 +1,11 @@
+from django import template
+from django.conf import settings
+
+from posts.trends import hot_groups as top_groups
+
+register = template.Library()
+
+
+@register.inclusion_tag('hot_groups.html')
+def hot_groups():
+    return {'groups': top_groups(settings.HOT_GROUPS_SIZE)}
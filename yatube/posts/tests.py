@@ -1,8 +1,55 @@
-from django.test import TestCase, Client
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.files.base import ContentFile
+from django.http import Http404
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+from . import (
+    archive, async_views, blobs, counters, db_router, follow_graph, page_cache, recommendations, sqlite, thumbnails, trends,
+)
+from .workers import generate_thumbnail
+from .models import (
+    Comment, Group, Post, User, Follow, TimelineEntry, UserStats, Recommendation, RecommendationRefresh,
+    GroupTrend, PostTrend, ArchivedComment, ArchivedPost, Blob, ScopeVersion, FollowChange, TimelineRefan,
+)
+
 
-from .models import Group, Post, User, Follow
+class QueryBudgetMixin:
+    """Проверка, что страница укладывается в фиксированное число SQL-запросов"""
+
+    def assertQueryBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Внутри TestCase транзакции чтения превращаются в SAVEPOINT, вне тестов их нет в журнале
+        queries = [q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url}: {len(queries)} запросов вместо {budget}:\n' + '\n'.join(q['sql'] for q in queries)
+        )
+        return response
 
 
 class NewPostTest(TestCase):
@@ -88,6 +135,7 @@ class FollowTest(TestCase):
         self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
         self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
         self.client.login(username='testuser', password='12345')
+        cache.clear()
 
     def test_auth_user_could_follow(self):
         """Авторизированный пользователь может создать связь в бд с другим пользователем (подписаться)"""
@@ -104,6 +152,15 @@ class FollowTest(TestCase):
         self.assertEqual(Follow.objects.all().count(), 0)
         self.assertEqual(response.status_code, 200)
 
+    def test_repeated_follow_creates_one_link(self):
+        """Повторная подписка не создаёт дубликат, уникальность защищена ограничением в бд"""
+        for _ in range(2):
+            self.client.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.author)
+
     def test_followed_user_could_see_post(self):
         """Подписанный пользователь видит пост автора в ленте"""
         self.client.get(reverse('profile_follow', kwargs={'username': self.author.username}))
@@ -118,6 +175,69 @@ class FollowTest(TestCase):
         self.assertNotContains(response, post.text)
 
 
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.client.login(username='testuser', password='12345')
+        cache.clear()
+
+    def test_new_post_fanned_out(self):
+        """Новый пост автора попадает в материализованную ленту подписчика"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='testtext', author=self.author)
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка добавляет в ленту старые посты автора, отписка их убирает"""
+        post = Post.objects.create(text='old_post', author=self.author)
+        self.client.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+        self.client.get(reverse('profile_unfollow', kwargs={'username': self.author.username}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_merged_on_read(self):
+        """Посты популярного автора не раскладываются по лентам, но видны в ленте подписок"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='celebrity_post', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, post.text)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1, TIMELINE_FANOUT_HYSTERESIS=0)
+    def test_former_celebrity_posts_refanned(self):
+        """Опустившийся до порога автор ждёт команды refan_timelines, до неё посты подмешиваются при чтении"""
+        other = User.objects.create_user(username='other', email='e@e.com', password='12345')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(text='celebrity_post', author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        Follow.objects.filter(user=other).delete()
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertContains(self.client.get(reverse('follow_index')), post.text)
+        call_command('refan_timelines', batch_size=1, stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+        self.assertFalse(UserStats.objects.get(user=self.author).celebrity)
+        self.assertFalse(TimelineRefan.objects.exists())
+        self.assertContains(self.client.get(reverse('follow_index')), post.text)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1, TIMELINE_FANOUT_HYSTERESIS=1)
+    def test_refan_hysteresis(self):
+        """Колебание числа подписчиков у порога не ставит автора в очередь раскладки"""
+        other = User.objects.create_user(username='other', email='e@e.com', password='12345')
+        Follow.objects.create(user=self.user, author=self.author)
+        for _ in range(3):
+            Follow.objects.create(user=other, author=self.author)
+            Follow.objects.filter(user=other).delete()
+        self.assertTrue(UserStats.objects.get(user=self.author).celebrity)
+        self.assertFalse(TimelineRefan.objects.exists())
+        Follow.objects.filter(user=self.user).delete()
+        self.assertTrue(TimelineRefan.objects.filter(author_id=self.author.id).exists())
+
+
+@override_settings(POSTS_THUMBNAIL_WORKERS=0)
 class NewImageTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -170,6 +290,7 @@ class NewImageTest(TestCase):
         self.assertEqual(Post.objects.count(), 2)
 
 
+@override_settings(POSTS_THUMBNAIL_WORKERS=0)
 class EditImageTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -209,6 +330,36 @@ class EditImageTest(TestCase):
         self.assertContains(response, '<img')
 
 
+@override_settings(POSTS_THUMBNAIL_WORKERS=1)
+class BackgroundThumbnailTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.future = Future()
+        self.executor = mock.Mock()
+        self.executor.submit.return_value = self.future
+
+    def test_placeholder_until_thumbnail_ready(self):
+        """Пока миниатюра готовится в фоне, карточка показывает заглушку"""
+        with mock.patch.object(thumbnails, '_get_executor', return_value=self.executor):
+            with open('media/posts/sal.png', 'rb') as img:
+                self.client.post(reverse('new_post'), data={'text': 'Background post', 'image': img})
+            post = Post.objects.get(text='Background post')
+            response = self.client.get(reverse('index'))
+            self.assertNotContains(response, '<img')
+            self.assertContains(response, 'Миниатюра ещё готовится')
+            self.client.get(reverse('index'))
+            self.executor.submit.assert_called_once_with(generate_thumbnail, post.pk)
+            generated = thumbnails.generate(post.pk)
+            with CaptureQueriesContext(connection) as queries:
+                self.future.set_result(generated)
+            # Колбэк пула только ставит картинку в очередь, карточки сбрасывает поток thumbnail-ready
+            self.assertEqual(len(queries), 0)
+            self.assertEqual(thumbnails.apply_ready(block=False), 1)
+        self.assertContains(self.client.get(reverse('index')), '<img')
+
+
 class ProfileTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -220,6 +371,987 @@ class ProfileTest(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class CountersTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.client.login(username='testuser', password='12345')
+
+    def test_counters_follow_writes(self):
+        """Счётчики постов, подписок и комментариев меняются вместе с записями"""
+        post = Post.objects.create(text='testtext', author=self.author)
+        self.client.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        self.client.post(
+            reverse('add_comment', kwargs={'username': self.author, 'post_id': post.id}),
+            data={'text': 'comment_text'}
+        )
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count, stats.following_count), (1, 1, 0))
+        self.assertEqual(UserStats.objects.get(user=self.user).following_count, 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+        self.client.get(reverse('profile_unfollow', kwargs={'username': self.author.username}))
+        post.delete()
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count), (0, 0))
+
+    def test_profile_shows_counters(self):
+        Post.objects.create(text='testtext', author=self.author)
+        response = self.client.get(reverse('profile', kwargs={'username': self.author.username}))
+        self.assertEqual(response.context['posts_count'], 1)
+        self.assertEqual(response.context['followers'], 0)
+
+    def test_reconcile_counters(self):
+        """Команда reconcile_counters исправляет расхождения"""
+        post = Post.objects.create(text='testtext', author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        Post.objects.filter(pk=post.pk).update(comments_count=7)
+        UserStats.objects.filter(user=self.user).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(UserStats.objects.get(user=self.author).posts_count, 1)
+        self.assertTrue(UserStats.objects.filter(user=self.user).exists())
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+
+
+class FeedQueriesTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.group = Group.objects.create(title='test', slug='test', description='empty')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.author, author=self.user)
+        for number in range(10):
+            for author in (self.user, self.author):
+                post = Post.objects.create(text=f'post_{number}', author=author, group=self.group)
+                Comment.objects.create(post=post, author=self.user, text='comment')
+        self.client.login(username='testuser', password='12345')
+
+    def test_feed_query_budget(self):
+        """Число запросов ленты не зависит от количества постов на странице"""
+        for url in (
+            reverse('index'),
+            reverse('group_posts', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': self.author.username}),
+            reverse('follow_index'),
+            reverse('followers_index'),
+        ):
+            with self.subTest(url=url):
+                self.assertQueryBudget(url, 10)
+
+
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.post = Post.objects.create(text='card_text', author=self.author)
+        self.edit_url = reverse('post_edit', kwargs={'username': self.author.username, 'post_id': self.post.id})
+
+    def test_card_shared_between_viewers(self):
+        """Закэшированная карточка отдаётся всем, ссылку на редактирование видит только автор"""
+        self.client.login(username='testuser', password='12345')
+        self.assertNotContains(self.client.get(reverse('index')), self.edit_url)
+        self.client.login(username='test_author', password='12345')
+        self.assertContains(self.client.get(reverse('index')), self.edit_url)
+
+    def test_edit_and_comment_bump_version(self):
+        """Редактирование и новый комментарий меняют версию карточки"""
+        self.client.login(username='test_author', password='12345')
+        self.client.get(reverse('index'))
+        self.client.post(self.edit_url, data={'text': 'edited_text'})
+        self.assertContains(self.client.get(reverse('index')), 'edited_text')
+        Comment.objects.create(post=self.post, author=self.user, text='comment')
+        self.assertContains(self.client.get(reverse('index')), 'всего: 1')
+        self.assertEqual(Post.objects.get(pk=self.post.pk).version, 2)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.group = Group.objects.create(title='test', slug='test', description='empty')
+        self.post = Post.objects.create(text='Приветствую всех котов', author=self.user, group=self.group)
+        Post.objects.create(text='Собаки тоже хорошие', author=self.user)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        return [post.text for post in response.context['page']], response
+
+    def test_prefix_search(self):
+        """Поиск находит пост по началу слова без учёта регистра"""
+        found, _ = self.search(q='привет кот')
+        self.assertEqual(found, [self.post.text])
+
+    def test_search_follows_edits_and_deletes(self):
+        """Индекс обновляется при редактировании и удалении поста"""
+        self.post.text = 'Теперь про попугаев'
+        self.post.save()
+        self.assertEqual(self.search(q='кот')[0], [])
+        self.assertEqual(self.search(q='попуга')[0], [self.post.text])
+        self.post.delete()
+        self.assertEqual(self.search(q='попуга')[0], [])
+
+    def test_search_filter_and_pages(self):
+        """Фильтр по группе и курсорная пагинация результатов"""
+        for number in range(12):
+            Post.objects.create(text=f'котики номер {number}', author=self.user, group=self.group)
+        self.assertEqual(self.search(q='собаки', group='test')[0], [])
+        first, response = self.search(q='кот', group='test')
+        page = response.context['page']
+        second = [post.text for post in self.client.get(f"{reverse('search')}?{page.next_query}").context['page']]
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(set(first + second)), 13)
+
+
+class PaginatorTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        for number in range(25):
+            Post.objects.create(text=f'post_{number:02}', author=self.user)
+
+    def test_cursor_pages_cover_all_posts(self):
+        """Курсорная пагинация проходит все посты без пропусков и повторов, в обе стороны"""
+        seen = []
+        response = self.client.get(reverse('index'))
+        pages = [response.context['page']]
+        while True:
+            page = pages[-1]
+            seen.extend(post.text for post in page)
+            if not page.has_next():
+                break
+            pages.append(self.client.get(f"{reverse('index')}?{page.next_query}").context['page'])
+        self.assertEqual(seen, [f'post_{number:02}' for number in reversed(range(25))])
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        response = self.client.get(f"{reverse('index')}?{pages[-1].previous_query}")
+        self.assertEqual(response.context['page'].number, 2)
+        self.assertEqual([post.text for post in response.context['page']], seen[10:20])
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(reverse('index'), {'after': 'broken'})
+        self.assertEqual(response.context['page'].number, 1)
+        self.assertContains(response, 'post_24')
+
+
+class SeedDataTest(TestCase):
+    def seed(self, **options):
+        call_command(
+            'seed_data', users=30, groups=3, posts=60, comments=80, images=0, seed=7, stdout=StringIO(), **options
+        )
+        return list(Post.objects.order_by('id').values_list('author__username', 'group__slug', 'text', 'pub_date'))
+
+    def test_seed_is_consistent(self):
+        """Набор данных создаётся целиком, счётчики и ленты сразу согласованы"""
+        self.seed()
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 80)
+        self.assertTrue(Follow.objects.exists())
+        self.assertTrue(TimelineEntry.objects.exists())
+        # Индексы подписок других процессов загрузятся заново
+        self.assertTrue(FollowChange.objects.filter(created=None).exists())
+        output = StringIO()
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('пользователей 0, постов 0', output.getvalue())
+
+    def test_seed_is_reproducible(self):
+        """С тем же seed получается тот же набор данных"""
+        first = self.seed()
+        self.assertEqual(self.seed(clear=True), first)
+
+    def test_benchmark_views(self):
+        """Бенчмарк проходит по всем основным страницам"""
+        self.seed()
+        output = StringIO()
+        call_command('benchmark_views', runs=2, warmup=0, stdout=output)
+        for view in ('index', 'group_posts', 'profile', 'post_view', 'follow_index', 'followers_index'):
+            self.assertIn(view, output.getvalue())
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        Post.objects.create(text='Metrics post', author=self.user)
+        cache.clear()
+
+    def test_server_timing_header(self):
+        """Выбранный запрос получает заголовок Server-Timing с временем БД и шаблонов"""
+        response = self.client.get(reverse('index'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        self.assertIn('page-miss=1', response['Server-Timing'])
+        self.assertIn('page-hit=1', self.client.get(reverse('index'))['Server-Timing'])
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        """Невыбранный запрос обходится без заголовка"""
+        self.assertNotIn('Server-Timing', self.client.get(reverse('index')))
+
+    def test_metrics_endpoint(self):
+        """/metrics отдаёт гистограммы по именам URL в формате Prometheus"""
+        self.client.get(reverse('profile', kwargs={'username': self.user.username}))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram', content)
+        self.assertIn('yatube_db_queries_count{view="profile"}', content)
+        self.assertIn('yatube_cache_requests_total{view="profile",cache="card",result="miss"}', content)
+
+    def test_metrics_endpoint_closed(self):
+        """С внешнего адреса /metrics недоступен"""
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 403)
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='author', email='a@a.com', password='12345')
+        self.group = Group.objects.create(title='test', slug='test', description='empty')
+        self.post = Post.objects.create(text='Api post', author=self.author, group=self.group)
+        cache.clear()
+
+    def test_feeds(self):
+        """Ленты API отдают посты в JSON"""
+        for url in (
+            reverse('api_index'),
+            reverse('api_group_posts', kwargs={'slug': self.group.slug}),
+            reverse('api_profile', kwargs={'username': self.author.username}),
+        ):
+            data = self.client.get(url).json()
+            self.assertEqual(data['results'][0]['text'], 'Api post')
+            self.assertEqual(data['results'][0]['username'], 'author')
+        self.assertEqual(self.client.get(reverse('api_group_posts', kwargs={'slug': 'nope'})).status_code, 404)
+
+    def test_cursor_pagination(self):
+        """Страницы API листаются курсором без повторов"""
+        Post.objects.bulk_create([Post(text=f'Post {n}', author=self.author) for n in range(25)])
+        first = self.client.get(reverse('api_index')).json()
+        second = self.client.get(reverse('api_index'), {'after': first['next']}).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 26)
+        self.assertFalse({row['id'] for row in first['results']} & {row['id'] for row in second['results']})
+        self.assertIsNone(second['next'])
+
+    def test_not_modified(self):
+        """Неизменившаяся лента отвечает 304 одним запросом отметок, новый пост меняет ETag"""
+        etag = self.client.get(reverse('api_index'))['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual([query['sql'] for query in queries if 'posts_scopeversion' not in query['sql']], [])
+        self.assertEqual(len(queries), 1)
+        Post.objects.create(text='Another post', author=self.author)
+        self.assertEqual(self.client.get(reverse('api_index'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_follow_feed(self):
+        """Лента подписок доступна только авторизованному и меняет ETag при подписке"""
+        url = reverse('api_follow_index')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(url)
+        self.assertEqual(response.json()['results'], [])
+        Follow.objects.create(user=self.user, author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['results'][0]['text'], 'Api post')
+
+    def test_post_with_comments(self):
+        """Пост отдаётся вместе с комментариями, новый комментарий меняет ETag"""
+        url = reverse('api_post', kwargs={'username': self.author.username, 'post_id': self.post.id})
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(post=self.post, author=self.user, text='Api comment')
+        data = self.client.get(url, HTTP_IF_NONE_MATCH=etag).json()
+        self.assertEqual(data['post']['comments_count'], 1)
+        self.assertEqual(data['comments']['results'][0]['text'], 'Api comment')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.group = Group.objects.create(title='test', slug='test', description='empty')
+        self.post = Post.objects.create(text='Conditional post', author=self.user, group=self.group)
+        self.urls = [
+            reverse('post', kwargs={'username': self.user.username, 'post_id': self.post.id}),
+            reverse('profile', kwargs={'username': self.user.username}),
+            reverse('group_posts', kwargs={'slug': self.group.slug}),
+        ]
+        cache.clear()
+
+    def test_not_modified(self):
+        """Неизменившаяся страница отвечает 304 одним запросом отметок областей"""
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(queries), 1)
+            self.assertIn('posts_scopeversion', queries[0]['sql'])
+
+    def test_if_modified_since(self):
+        """Гостю страница отдаётся с Last-Modified и отвечает на If-Modified-Since"""
+        for url in self.urls:
+            last_modified = self.client.get(url)['Last-Modified']
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_changes_reset_etag(self):
+        """Комментарий и правка поста меняют ETag страниц"""
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(post=self.post, author=self.user, text='New comment')
+        for url, etag in zip(self.urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """После входа старый ETag гостя не подходит, Last-Modified не отдаётся"""
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+class CommentPaginationTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.post = Post.objects.create(text='Viral post', author=self.user)
+        for number in range(25):
+            Comment.objects.create(post=self.post, author=self.user, text=f'comment_{number:02}')
+        self.url = reverse('post', kwargs={'username': self.user.username, 'post_id': self.post.id})
+        cache.clear()
+
+    def test_initial_render_is_capped(self):
+        """На странице поста только последние комментарии и кнопка «Загрузить ещё»"""
+        response = self.assertQueryBudget(self.url, 6)
+        self.assertContains(response, 'comment_24')
+        self.assertContains(response, 'comment_05')
+        self.assertNotContains(response, 'comment_04')
+        self.assertIsNotNone(response.context['comments_next'])
+
+    def test_load_older_fragment(self):
+        """Фрагмент со следующей страницей содержит оставшиеся комментарии"""
+        after = self.client.get(self.url).context['comments_next']
+        url = reverse('post_comments', kwargs={'username': self.user.username, 'post_id': self.post.id})
+        response = self.client.get(url, {'after': after})
+        self.assertContains(response, 'comment_04')
+        self.assertContains(response, 'comment_00')
+        self.assertNotContains(response, 'comment_05')
+        self.assertNotContains(response, '<html')
+        self.assertIsNone(response.context['comments_next'])
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.friend, self.friend_of_friend, self.neighbour, self.neighbours_author = (
+            User.objects.create_user(username=name) for name in ('friend', 'fof', 'neighbour', 'neighbours_author')
+        )
+        Follow.objects.create(user=self.user, author=self.friend)
+        Follow.objects.create(user=self.friend, author=self.friend_of_friend)
+        Follow.objects.create(user=self.neighbour, author=self.friend)
+        Follow.objects.create(user=self.neighbour, author=self.neighbours_author)
+
+    def recommended(self, user):
+        return list(Recommendation.objects.filter(user=user).order_by('-score').values_list('author__username', flat=True))
+
+    def test_friends_of_friends_and_co_follows(self):
+        """Рекомендуются друзья друзей и подписки похожих пользователей, но не свои подписки"""
+        recommendations.refresh()
+        self.assertEqual(self.recommended(self.user), ['fof', 'neighbours_author'])
+
+    def test_popular_for_users_without_follows(self):
+        """Без подписок рекомендуются популярные авторы, отсортированные один раз на весь пересчёт"""
+        for name in ('new_1', 'new_2'):
+            User.objects.create_user(username=name)
+        with mock.patch.object(recommendations.np, 'argsort', wraps=recommendations.np.argsort) as argsort:
+            recommendations.refresh()
+        self.assertEqual(argsort.call_count, 1)
+        self.assertEqual(self.recommended(User.objects.get(username='new_1'))[:1], ['friend'])
+
+    def test_incremental_refresh(self):
+        """Без --full пересчитываются только пользователи с изменившимися подписками"""
+        recommendations.refresh()
+        self.assertFalse(RecommendationRefresh.objects.exists())
+        Follow.objects.create(user=self.user, author=self.friend_of_friend)
+        Recommendation.objects.filter(user=self.neighbour).delete()
+        self.assertEqual(recommendations.refresh_changed(), 1)
+        self.assertEqual(self.recommended(self.user), ['neighbours_author'])
+        self.assertEqual(self.recommended(self.neighbour), [])
+        self.assertFalse(RecommendationRefresh.objects.exists())
+
+    def test_refresh_changes_only_own_etags(self):
+        """Пересчёт меняет ETag страниц пользователя, не сбрасывая кэш всего сайта"""
+        self.client.login(username='testuser', password='12345')
+        url = reverse('profile', kwargs={'username': self.friend.username})
+        etag = self.client.get(url)['ETag']
+        site = page_cache.generations([page_cache.SITE])
+        recommendations.refresh([self.user.id])
+        self.assertEqual(page_cache.generations([page_cache.SITE]), site)
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_who_to_follow_on_profile(self):
+        """Блок «Кого почитать» показывается на профиле и пропускает уже отслеживаемых"""
+        recommendations.refresh()
+        self.client.login(username='testuser', password='12345')
+        url = reverse('profile', kwargs={'username': self.user.username})
+        self.assertContains(self.client.get(url), reverse('profile_follow', kwargs={'username': 'fof'}))
+        Follow.objects.create(user=self.user, author=self.friend_of_friend)
+        self.assertNotContains(self.client.get(url), reverse('profile_follow', kwargs={'username': 'fof'}))
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        Follow.objects.create(user=self.user, author=self.author)
+        cache.clear()
+
+    def test_answers_from_memory(self):
+        """Индекс отвечает на «подписан ли» и считает подписки без запросов к бд"""
+        follow_graph.is_following(self.user.id, self.author.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(follow_graph.is_following(self.user.id, self.author.id))
+            self.assertFalse(follow_graph.is_following(self.author.id, self.user.id))
+            self.assertEqual(follow_graph.followers_count(self.author.id), 1)
+            self.assertEqual(follow_graph.following_count(self.user.id), 1)
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(FOLLOW_GRAPH_SYNC_INTERVAL=0)
+    def test_changes_of_other_processes(self):
+        """Записи журнала других процессов проигрываются, invalidate() перезагружает индекс"""
+        follow_graph.is_following(self.user.id, self.author.id)
+        # Другой процесс: подписка уже в бд, а в журнале — её запись
+        Follow.objects.bulk_create([Follow(user=self.author, author=self.user)])
+        FollowChange.objects.create(created=True, user_id=self.author.id, author_id=self.user.id)
+        self.assertTrue(follow_graph.is_following(self.author.id, self.user.id))
+        Follow.objects.all().delete()
+        follow_graph.invalidate()
+        self.assertFalse(follow_graph.is_following(self.user.id, self.author.id))
+
+    @override_settings(FOLLOW_GRAPH_SYNC_INTERVAL=0)
+    def test_rolled_back_follow(self):
+        """Откаченная подписка не остаётся в индексе"""
+        follow_graph.is_following(self.user.id, self.author.id)
+        with self.assertRaises(ValueError), transaction.atomic():
+            Follow.objects.create(user=self.author, author=self.user)
+            self.assertTrue(follow_graph.is_following(self.author.id, self.user.id))
+            raise ValueError
+        self.assertFalse(follow_graph.is_following(self.author.id, self.user.id))
+
+    def test_profile_uses_index(self):
+        """Профиль берёт состояние подписки и счётчики из индекса"""
+        self.client.login(username='testuser', password='12345')
+        url = reverse('profile', kwargs={'username': self.author.username})
+        response = self.client.get(url)
+        self.assertTrue(response.context['follow'])
+        self.assertEqual(response.context['followers'], 1)
+        self.assertIn('yatube_follow_graph_bytes', self.client.get(reverse('metrics')).content.decode())
+
+
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.post = Post.objects.create(text='Async post', author=self.author)
+        Comment.objects.create(post=self.post, author=self.user, text='Async comment')
+        Follow.objects.create(user=self.user, author=self.author)
+        cache.clear()
+
+    def get(self, view, user=None, headers=None, **kwargs):
+        request = self.factory.get('/', **(headers or {}))
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_pages(self):
+        """Асинхронные ленты, профиль и пост отдают те же данные, что синхронные"""
+        self.assertContains(self.get(async_views.index), 'Async post')
+        response = self.get(async_views.profile, username=self.author.username)
+        self.assertContains(response, 'Async post')
+        self.assertContains(response, 'всего: 1')
+        response = self.get(async_views.post_view, username=self.author.username, post_id=self.post.id)
+        self.assertContains(response, 'Async comment')
+        with self.assertRaises(Http404):
+            self.get(async_views.profile, username='nobody')
+
+    def test_archived_post(self):
+        """Пост из архива отдаётся с комментариями архива, потоки пула закрывают соединения"""
+        Post.objects.filter(pk=self.post.pk).update(pub_date=dt.datetime(2000, 1, 1, tzinfo=dt.timezone.utc))
+        call_command('archive_posts', stdout=StringIO())
+        with mock.patch('posts.async_views.close_old_connections') as close:
+            response = self.get(async_views.post_view, username=self.author.username, post_id=self.post.id)
+        self.assertContains(response, 'Async comment')
+        self.assertTrue(close.called)
+        self.assertContains(self.get(async_views.follow_index, user=self.user), 'Async post')
+
+    def test_groups_reuse_thread_connection(self):
+        """Группы в одном потоке пула работают на одном соединении, PRAGMA не повторяются"""
+        async def groups():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+            for _ in range(3):
+                await async_views.in_thread(User.objects.count)()
+
+        # Тестовая бд в памяти, её соединения Django не закрывает никогда
+        in_memory = mock.patch.object(type(connections['default']), 'is_in_memory_db', return_value=False)
+        with in_memory, mock.patch('posts.sqlite.configure', wraps=sqlite.configure) as configure:
+            asyncio.run(groups())
+        self.assertEqual(configure.call_count, 1)
+
+    def test_not_modified(self):
+        """Неизменившийся профиль отвечает 304 по ETag"""
+        etag = self.get(async_views.profile, username=self.author.username)['ETag']
+        response = self.get(async_views.profile, headers={'if-none-match': etag}, username=self.author.username)
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_index(self):
+        """Лента подписок доступна только после входа и содержит посты авторов"""
+        self.assertEqual(self.get(async_views.follow_index).status_code, 302)
+        self.assertContains(self.get(async_views.follow_index, user=self.user), 'Async post')
+
+    def test_benchmark(self):
+        """Замер ASGI проходит по всем страницам"""
+        out = StringIO()
+        call_command('benchmark_asgi', mode='asgi', requests=2, concurrency=2, threads=2, stdout=out, stderr=StringIO())
+        self.assertIn('follow_index', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+class DatabaseRoutingTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.router = db_router.PrimaryReplicaRouter()
+
+    def test_router(self):
+        """Чтения безопасного запроса идут в реплику, записи и всё вне запросов — в основную базу"""
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        with override_settings(DATABASE_REPLICAS=['replica1', 'replica2']):
+            with db_router.routing(replicas_allowed=True) as route:
+                replica = self.router.db_for_read(Post)
+                self.assertIn(replica, ['replica1', 'replica2'])
+                self.assertEqual(self.router.db_for_read(Comment), replica)
+                self.assertEqual(self.router.db_for_write(Post), 'default')
+                self.assertFalse(route.wrote)
+            with db_router.routing(replicas_allowed=False):
+                self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_pin_after_write(self):
+        """После записи браузер закрепляется за основной базой, чтение куку не ставит"""
+        self.client.login(username='testuser', password='12345')
+        self.assertNotIn(settings.PRIMARY_PIN_COOKIE, self.client.get(reverse('index')).cookies)
+        response = self.client.post(reverse('new_post'), {'text': 'Pinned post'})
+        self.assertIn(settings.PRIMARY_PIN_COOKIE, response.cookies)
+        self.client.cookies.pop(settings.PRIMARY_PIN_COOKIE)
+        response = self.client.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        self.assertIn(settings.PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_read_only_get_not_pinned(self):
+        """Профиль читает индекс подписок с основной базы, но без записи куку не ставит"""
+        Follow.objects.create(user=self.user, author=self.author)
+        url = reverse('profile', kwargs={'username': self.author.username})
+        self.assertNotIn(settings.PRIMARY_PIN_COOKIE, self.client.get(url).cookies)
+        self.client.login(username='testuser', password='12345')
+        self.assertNotIn(settings.PRIMARY_PIN_COOKIE, self.client.get(url).cookies)
+
+    def test_pinned_request_reads_primary(self):
+        """С кукой закрепления запрос не получает реплику"""
+        routes = []
+        original = db_router.routing
+
+        def spy(replicas_allowed):
+            routes.append(replicas_allowed)
+            return original(replicas_allowed)
+
+        with mock.patch.object(db_router, 'routing', spy):
+            self.client.get(reverse('index'))
+            self.client.cookies[settings.PRIMARY_PIN_COOKIE] = '1'
+            self.client.get(reverse('index'))
+        self.assertEqual(routes, [True, False])
+
+
+class SqliteTest(TestCase):
+    def test_pragmas(self):
+        """Соединение получает настройки из SQLITE_PRAGMAS"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def try_lock(self):
+        """Удаётся ли другому потоку встать в очередь записи без ожидания"""
+        result = Future()
+
+        def target():
+            acquired = sqlite._write_lock.acquire(blocking=False)
+            if acquired:
+                sqlite._write_lock.release()
+            result.set_result(acquired)
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        return result.result()
+
+    def test_serialized_write(self):
+        """Пока идёт пишущая транзакция, другой поток ждёт очереди; без SQLITE_SERIALIZE_WRITES — нет"""
+        with sqlite.serialized_write():
+            self.assertTrue(connection.in_atomic_block)
+            self.assertFalse(self.try_lock())
+        with override_settings(SQLITE_SERIALIZE_WRITES=False), sqlite.serialized_write():
+            self.assertTrue(self.try_lock())
+
+
+class TrendingTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.quiet = Group.objects.create(title='Quiet', slug='quiet', description='empty')
+        self.busy = Group.objects.create(title='Busy', slug='busy', description='empty')
+        self.old = Post.objects.create(text='Quiet post', author=self.user, group=self.quiet)
+        self.hot = Post.objects.create(text='Hot post', author=self.user, group=self.busy)
+        for number in range(3):
+            Comment.objects.create(post=self.hot, author=self.user, text=f'comment {number}')
+        cache.clear()
+
+    def test_comments_raise_posts_and_groups(self):
+        """Комментарии поднимают пост и его группу выше"""
+        self.assertEqual(trends.top_posts(10), [self.hot, self.old])
+        self.assertEqual(trends.hot_groups(10), [self.busy, self.quiet])
+        response = self.assertQueryBudget(reverse('trending'), 4)
+        self.assertContains(response, 'Hot post')
+        self.assertContains(response, reverse('group_posts', kwargs={'slug': 'busy'}))
+
+    def test_rebase_keeps_order(self):
+        """Перенос точки отсчёта сохраняет порядок, затухает оценки и удаляет ничтожные"""
+        score = PostTrend.objects.get(pk=self.hot.pk).score
+        half_life = dt.timedelta(seconds=settings.TRENDING_HALF_LIFE)
+        epoch = trends.TrendEpoch.objects.get().started
+        trends.rebase(epoch + 2 * half_life)
+        self.assertAlmostEqual(PostTrend.objects.get(pk=self.hot.pk).score, score / 4)
+        self.assertEqual(trends.top_posts(10), [self.hot, self.old])
+        self.assertEqual(trends.rebase(epoch + 20 * half_life), 4)
+        self.assertFalse(GroupTrend.objects.exists())
+
+    def test_rebase_command(self):
+        """rebase_trends переносит точку отсчёта, только когда она устарела, или с --force"""
+        started = trends.TrendEpoch.objects.get().started
+        call_command('rebase_trends', stdout=StringIO())
+        self.assertEqual(trends.TrendEpoch.objects.get().started, started)
+        call_command('rebase_trends', '--force', stdout=StringIO())
+        self.assertGreater(trends.TrendEpoch.objects.get().started, started)
+
+    def test_record_uses_current_epoch(self):
+        """Событие взвешивается от точки отсчёта в бд, даже если её перенёс другой процесс"""
+        epoch = trends.TrendEpoch.objects.get()
+        epoch.started -= dt.timedelta(seconds=10 * settings.TRENDING_HALF_LIFE)
+        epoch.save()
+        post = Post.objects.create(text='New post', author=self.user)
+        self.assertGreater(PostTrend.objects.get(pk=post.pk).score, 2 ** 9 * settings.TRENDING_POST_WEIGHT)
+
+    def test_stale_epoch_rebased_on_write(self):
+        """Если точку отсчёта давно не переносили, запись переносит её сама, а не падает с OverflowError"""
+        epoch = trends.TrendEpoch.objects.get()
+        epoch.started -= dt.timedelta(seconds=2000 * settings.TRENDING_HALF_LIFE)
+        epoch.save()
+        post = Post.objects.create(text='New post', author=self.user)
+        self.assertAlmostEqual(PostTrend.objects.get(pk=post.pk).score, settings.TRENDING_POST_WEIGHT, places=2)
+        self.assertEqual(trends.top_posts(1), [post])
+
+    def test_rebuild(self):
+        """Пересчёт с нуля даёт тот же порядок, что и сигналы"""
+        trends.rebuild()
+        self.assertEqual(trends.top_posts(10), [self.hot, self.old])
+        self.assertAlmostEqual(
+            PostTrend.objects.get(pk=self.hot.pk).score,
+            settings.TRENDING_POST_WEIGHT + 3 * settings.TRENDING_COMMENT_WEIGHT, places=2,
+        )
+
+
+class TransferTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.group = Group.objects.create(title='Transfer', slug='transfer', description='empty')
+        self.post = Post.objects.create(text='Moved post', author=self.author, group=self.group)
+        Comment.objects.create(post=self.post, author=self.user, text='Moved comment')
+        Follow.objects.create(user=self.user, author=self.author)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dump.ndjson')
+        call_command('export_ndjson', self.path, stdout=StringIO())
+        Post.objects.all().delete()
+        Follow.objects.all().delete()
+        Group.objects.all().delete()
+        self.author.delete()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        """Загрузка восстанавливает записи, связи по username и slug и производные данные"""
+        call_command('import_ndjson', self.path, batch_size=1, stdout=StringIO())
+        post = Post.objects.select_related('author', 'group').get()
+        self.assertEqual((post.text, post.author.username, post.group.slug), ('Moved post', 'test_author', 'transfer'))
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(Comment.objects.get().author, self.user)
+        self.assertTrue(Follow.objects.filter(user=self.user, author=post.author).exists())
+        self.assertEqual(UserStats.objects.get(user=post.author).followers_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+        self.assertFalse(post.author.has_usable_password())
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint'))
+
+    def test_resume(self):
+        """Прерванная загрузка продолжается с сохранённой позиции, повтор пачки не дублирует записи"""
+        with open(self.path, 'rb') as dump:
+            groups = len(dump.readline())
+        with open(f'{self.path}.checkpoint', 'w') as checkpoint:
+            json.dump({'offset': groups}, checkpoint)
+        call_command('import_ndjson', self.path, stdout=StringIO())
+        self.assertFalse(Group.objects.exists())
+        self.assertIsNone(Post.objects.get().group)
+        call_command('import_ndjson', self.path, merge=True, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_refuses_to_overlap(self):
+        """Без --merge загрузка не идёт в базу, где уже есть посты"""
+        Post.objects.create(text='Existing', author=self.user)
+        with self.assertRaises(CommandError):
+            call_command('import_ndjson', self.path, stdout=StringIO())
+
+
+class ExportDataTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.author = User.objects.create_user(username='test_author', email='w@w.com', password='12345')
+        self.media = tempfile.TemporaryDirectory()
+        override = override_settings(MEDIA_ROOT=self.media.name, POSTS_THUMBNAIL_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self.media.cleanup)
+        self.post = Post.objects.create(text='Exported post', author=self.user)
+        self.post.image.save('exported.gif', ContentFile(b'GIF89a' + b'\0' * 200000))
+        Comment.objects.create(post=self.post, author=self.user, text='Exported comment')
+        Follow.objects.create(user=self.user, author=self.author)
+        self.url = reverse('export_data', kwargs={'username': self.user.username})
+
+    def test_owner_gets_zip(self):
+        """Владелец получает потоковый zip с NDJSON и исходными изображениями"""
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        archive = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+        records = [json.loads(line) for line in archive.read('data.ndjson').splitlines()]
+        self.assertEqual([record['model'] for record in records], ['post', 'comment', 'follow'])
+        self.assertEqual(records[2]['author'], 'test_author')
+        self.assertEqual(archive.read(self.post.image.name), self.post.image.open('rb').read())
+
+    def test_only_owner(self):
+        """Чужой архив недоступен, гостя отправляют на вход"""
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.login(username='test_author', password='12345')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class ArchiveTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.group = Group.objects.create(title='Archive', slug='archive', description='empty')
+        old = dt.datetime(2000, 1, 1, tzinfo=dt.timezone.utc)
+        for number in range(12):
+            post = Post.objects.create(text=f'post_{number:02}', author=self.user, group=self.group)
+            Post.objects.filter(pk=post.pk).update(pub_date=old + dt.timedelta(minutes=number))
+        self.old_post = post
+        Comment.objects.create(post=self.old_post, author=self.user, text='Old comment')
+        for number in range(12, 15):
+            Post.objects.create(text=f'post_{number:02}', author=self.user, group=self.group)
+        cache.clear()
+        call_command('archive_posts', stdout=StringIO())
+
+    def walk(self, url):
+        texts, query = [], ''
+        while True:
+            page = self.client.get(f'{url}?{query}').context['page']
+            texts.extend(post.text for post in page)
+            if not page.has_next():
+                return texts, page
+            query = page.next_query
+
+    def test_moves_old_posts_keeping_counters(self):
+        """Старые посты с комментариями уходят в архив, счётчики автора не меняются"""
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(ArchivedPost.objects.count(), 12)
+        self.assertEqual(ArchivedComment.objects.get().post_id, self.old_post.pk)
+        self.assertEqual(ArchivedPost.objects.get(pk=self.old_post.pk).comments_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 15)
+        self.assertEqual(counters.reconcile_users(User.objects.all()), 0)
+
+    def test_feeds_fall_through_to_archive(self):
+        """Ленты листаются от горячих постов к архивным без пропусков, в обе стороны"""
+        expected = [f'post_{number:02}' for number in reversed(range(15))]
+        for url in (reverse('index'), reverse('group_posts', args=['archive']), reverse('profile', args=['testuser'])):
+            texts, last = self.walk(url)
+            self.assertEqual(texts, expected, url)
+        response = self.client.get(f"{reverse('profile', args=['testuser'])}?{last.previous_query}")
+        self.assertEqual([post.text for post in response.context['page']], expected[5:10])
+        self.assertEqual(response.context['posts_count'], 15)
+
+    def test_follow_feed_falls_through_to_archive(self):
+        """Лента подписок, как и остальные, дочитывает архивные посты авторов"""
+        reader = User.objects.create_user(username='reader', email='r@r.com', password='12345')
+        Follow.objects.create(user=reader, author=self.user)
+        self.client.force_login(reader)
+        expected = [f'post_{number:02}' for number in reversed(range(15))]
+        self.assertEqual(self.walk(reverse('follow_index'))[0], expected)
+        texts, query = [], ''
+        while query is not None:
+            page = self.client.get(f"{reverse('api_follow_index')}?{query}").json()
+            texts.extend(post['text'] for post in page['results'])
+            query = page['next'] and f"after={page['next']}"
+        self.assertEqual(texts, expected)
+
+    def test_archived_posts_searchable(self):
+        """Архивные посты остаются в поиске, в том числе с фильтром по группе"""
+        response = self.client.get(reverse('search'), {'q': 'post_00', 'group': 'archive'})
+        self.assertEqual([post.text for post in response.context['page']], ['post_00'])
+        ArchivedPost.objects.filter(text='post_00').delete()
+        response = self.client.get(reverse('search'), {'q': 'post_00'})
+        self.assertEqual(list(response.context['page']), [])
+
+    def test_hot_page_skips_archive(self):
+        """Полная страница горячих постов новее границы читает из архива только границу"""
+        for number in range(15, 25):
+            Post.objects.create(text=f'post_{number:02}', author=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        archived = [query['sql'] for query in queries if 'posts_archivedpost' in query['sql']]
+        self.assertEqual(len(archived), 1)
+        self.assertIn('LIMIT 1', archived[0])
+
+    def test_boundary_follows_archive(self):
+        """Граница читается из бд, поэтому следующий перенос сразу виден лентам"""
+        self.assertEqual(self.walk(reverse('index'))[0], [f'post_{number:02}' for number in range(14, -1, -1)])
+        Post.objects.filter(text='post_12').update(pub_date=dt.datetime(2001, 1, 1, tzinfo=dt.timezone.utc))
+        call_command('archive_posts', stdout=StringIO())
+        self.assertEqual(self.walk(reverse('index'))[0], [f'post_{number:02}' for number in range(14, -1, -1)])
+
+    def test_archived_post_page(self):
+        """Страница архивного поста открывается с комментариями, комментировать его нельзя"""
+        self.client.force_login(self.user)
+        url = reverse('post', args=['testuser', self.old_post.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'Old comment')
+        self.assertNotContains(response, reverse('post_edit', args=['testuser', self.old_post.pk]))
+        response = self.client.post(reverse('add_comment', args=['testuser', self.old_post.pk]), {'text': 'New'})
+        self.assertRedirects(response, url)
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(reverse('api_post', args=['testuser', self.old_post.pk]))
+        self.assertEqual(response.json()['comments']['results'][0]['text'], 'Old comment')
+
+
+class BlobStorageTest(TransactionTestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.media = tempfile.TemporaryDirectory()
+        override = override_settings(MEDIA_ROOT=self.media.name, POSTS_THUMBNAIL_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self.media.cleanup)
+        with open('media/posts/sal.png', 'rb') as img:
+            self.content = img.read()
+
+    def publish(self, text, name='meme.png', content=None):
+        image = ContentFile(content or self.content, name=name)
+        self.client.post(reverse('new_post'), data={'text': text, 'image': image})
+        return Post.objects.get(text=text)
+
+    def test_same_upload_stored_once(self):
+        """Одинаковые загрузки лежат в одном файле под хешем содержимого, ссылки считаются"""
+        first, second = self.publish('First'), self.publish('Second', name='copy.PNG')
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(first.image.name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(Blob.objects.get(name=first.image.name).refs, 2)
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'posts', digest[:2], digest[2:4])), [f'{digest}.png'])
+
+    def test_file_removed_with_last_reference(self):
+        """Файл удаляется только вместе с последним постом, который на него ссылается"""
+        first, second = self.publish('First'), self.publish('Second')
+        path = first.image.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_replaced_image_released(self):
+        """При замене картинки в редактировании старый файл теряет ссылку"""
+        post = self.publish('Edited')
+        path = post.image.path
+        with open('media/posts/sal.gif', 'rb') as img:
+            self.client.post(reverse('post_edit', args=['testuser', post.pk]), {'text': 'Edited', 'image': img})
+        post.refresh_from_db()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(list(Blob.objects.values_list('name', 'refs')), [(post.image.name, 1)])
+        blobs.rebuild()
+        self.assertEqual(list(Blob.objects.values_list('name', 'refs')), [(post.image.name, 1)])
+
+
+@override_settings(POSTS_THUMBNAIL_WORKERS=0, POST_IMAGE_FORMATS=('JPEG',))
+class ResponsiveImageTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.media = tempfile.TemporaryDirectory()
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self.media.cleanup)
+        cache.clear()
+
+    def test_card_srcset(self):
+        """Карточка отдаёт варианты всех ширин через srcset"""
+        with open('media/posts/sal.png', 'rb') as img:
+            self.client.post(reverse('new_post'), data={'text': 'Responsive post', 'image': img})
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<picture>')
+        self.assertContains(response, 'type="image/jpeg"')
+        for width in settings.POST_IMAGE_WIDTHS:
+            self.assertContains(response, f' {width}w')
+
+    def test_oversized_rejected_by_header(self):
+        """Слишком большое изображение отклоняется по заголовку, хотя пикселей в файле нет"""
+        ihdr = b'IHDR' + struct.pack('>IIBBBBB', 20000, 20000, 8, 2, 0, 0, 0)
+        idat = b'IDAT'
+        header = (
+            b'\x89PNG\r\n\x1a\n'
+            + struct.pack('>I', 13) + ihdr + struct.pack('>I', zlib.crc32(ihdr))
+            + struct.pack('>I', 0) + idat + struct.pack('>I', zlib.crc32(idat))
+        )
+        image = ContentFile(header, name='huge.png')
+        response = self.client.post(reverse('new_post'), data={'text': 'Huge post', 'image': image})
+        self.assertFormError(
+            response, 'form', 'image',
+            f'Изображение слишком большое, допустимо до {settings.POST_IMAGE_MAX_PIXELS} пикселей.',
+        )
+        self.assertFalse(Post.objects.exists())
+
+
 class ErrorTest(TestCase):
     def test_404_error(self):
         response = self.client.get('fgjsfg')
@@ -231,16 +1363,90 @@ class CacheTest(TestCase):
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', email='q@q.com', password='12345')
-        self.client.login(username='testuser', password='12345')
         self.post = Post.objects.create(text="Test post", author=self.user)
 
     def test_cache_index(self):
-        """Тестирование функции кэша на главной странице"""
+        """Главная страница кэшируется для гостя и сбрасывается при публикации поста"""
         response = self.client.get('')
         self.assertContains(response, self.post.text)
-        post = Post.objects.create(text="Test cache post", author=self.user)
+        # update() не отправляет сигналов, поэтому гость получает закэшированную страницу
+        Post.objects.filter(pk=self.post.pk).update(text='Changed silently', version=F('version') + 1)
         response = self.client.get("")
-        self.assertNotContains(response, post.text)
-        cache.clear()
+        self.assertContains(response, self.post.text)
+        post = Post.objects.create(text="Test cache post", author=self.user)
         response = self.client.get("")
         self.assertContains(response, post.text)
+        self.assertContains(response, 'Changed silently')
+
+    def test_comment_resets_profile_cache(self):
+        """Комментарий сбрасывает закэшированную страницу профиля"""
+        url = reverse('profile', kwargs={'username': self.user.username})
+        self.assertNotContains(self.client.get(url), 'всего: 1')
+        Comment.objects.create(post=self.post, author=self.user, text='comment')
+        self.assertContains(self.client.get(url), 'всего: 1')
+
+    def test_logged_in_user_not_cached(self):
+        """Авторизованный пользователь получает страницу без кэша"""
+        self.client.get('')
+        Post.objects.filter(pk=self.post.pk).update(text='Changed silently', version=F('version') + 1)
+        self.client.login(username='testuser', password='12345')
+        self.assertContains(self.client.get(''), 'Changed silently')
+
+    def test_stale_page_while_recomputing(self):
+        """Пока страницу пересчитывает другой запрос, гость получает прежнюю версию"""
+        self.client.get('')
+        Post.objects.filter(pk=self.post.pk).update(text='Changed silently', version=F('version') + 1)
+        page_cache.touch('index')
+        key = page_cache.PAGE_KEY.format(hashlib.md5(b'/').hexdigest())
+        cache.add(f'{key}:lock', 1)
+        try:
+            self.assertContains(self.client.get(''), self.post.text)
+        finally:
+            cache.delete(f'{key}:lock')
+        self.assertContains(self.client.get(''), 'Changed silently')
+
+    def test_cold_page_waits_for_render(self):
+        """Страницу без прежней версии, которую уже считает другой запрос, ждут, а не считают заново"""
+        cache.clear()
+        key = page_cache.PAGE_KEY.format(hashlib.md5(b'/').hexdigest())
+        version = tuple(page_cache.generations(['index', page_cache.SITE]).values())
+        cache.add(f'{key}:lock', 1)
+
+        def render_elsewhere(_):
+            cache.set(key, (version, b'Rendered elsewhere', 'text/html'))
+
+        try:
+            with mock.patch('posts.page_cache.time.sleep', side_effect=render_elsewhere):
+                self.assertEqual(self.client.get('').content, b'Rendered elsewhere')
+        finally:
+            cache.delete(f'{key}:lock')
+
+    def test_cold_page_rendered_when_lock_dropped(self):
+        """Если запрос с блокировкой ничего не положил, ожидающий считает страницу сам"""
+        cache.clear()
+        key = page_cache.PAGE_KEY.format(hashlib.md5(b'/').hexdigest())
+        cache.add(f'{key}:lock', 1)
+        with mock.patch('posts.page_cache.time.sleep', side_effect=lambda _: cache.delete(f'{key}:lock')):
+            self.assertContains(self.client.get(''), self.post.text)
+
+    def test_changes_of_other_processes(self):
+        """Отметки областей хранятся в бд: изменение из другого процесса сбрасывает страницу"""
+        self.client.get('')
+        Post.objects.filter(pk=self.post.pk).update(text='Changed silently', version=F('version') + 1)
+        ScopeVersion.objects.filter(scope='index').update(changed=F('changed') + 1)
+        self.assertContains(self.client.get(''), 'Changed silently')
+
+    def test_rolled_back_change_keeps_versions(self):
+        """Отметки меняются в транзакции записи: откат оставляет прежние"""
+        before = page_cache.generations(['index', page_cache.SITE])
+        with self.assertRaises(ValueError), transaction.atomic():
+            Post.objects.create(text='Rolled back', author=self.user)
+            raise ValueError
+        self.assertEqual(page_cache.generations(['index', page_cache.SITE]), before)
+
+    def test_evicted_cache_keeps_versions(self):
+        """Очистка кэша не сбрасывает отметки: прежний ETag по-прежнему подходит"""
+        url = reverse('profile', kwargs={'username': self.user.username})
+        etag = self.client.get(url)['ETag']
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
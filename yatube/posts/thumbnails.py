@@ -0,0 +1,215 @@
+"""Миниатюры постов готовятся заранее, в пуле процессов.
+
+new_post и post_edit ставят генерацию в очередь после коммита, а карточка
+поста при рендере только ищет готовую миниатюру в key-value store sorl и,
+пока её нет, показывает заглушку. Когда воркер закончил, колбэк пула только
+кладёт имя картинки в очередь, а поток thumbnail-ready сбрасывает версии
+карточек (Post.version) и закэшированные страницы постов через
+serialized_write и закрывает свои соединения после каждой пачки.
+
+Миниатюра ключуется именем исходного файла, а в хранилище по содержимому
+(posts.storage) имя и есть хеш содержимого: одна картинка у многих постов
+генерируется один раз, и готовая миниатюра сбрасывает карточки их всех.
+
+Для srcset карточки воркер готовит варианты всех ширин POST_IMAGE_WIDTHS в
+каждом формате POST_IMAGE_FORMATS (WebP — если Pillow умеет его писать) с тем
+же кадрированием, что и основная миниатюра 960x339.
+"""
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from PIL import features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend as SorlThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from . import page_cache
+from .models import Post
+from .sqlite import serialized_write
+from .workers import generate_thumbnail, process_pool
+
+logger = logging.getLogger(__name__)
+
+POST_THUMBNAIL = '960x339'
+POST_THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+_executor = None
+_pending = set()
+_ready = queue.SimpleQueue()
+_lock = threading.Lock()
+
+
+class ThumbnailBackend(SorlThumbnailBackend):
+    """Бэкенд sorl, который умеет искать готовую миниатюру, не создавая её"""
+
+    def _options(self, source, options):
+        # Те же умолчания, что подставляет SorlThumbnailBackend.get_thumbnail
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def _thumbnail_file(self, file_, geometry_string, options):
+        source = ImageFile(file_)
+        name = self._get_thumbnail_filename(source, geometry_string, self._options(source, options))
+        return ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        return default.kvstore.get(self._thumbnail_file(file_, geometry_string, options))
+
+    def forget_missing(self, file_, geometry_string, **options):
+        """Убирает закэшированный промах cached_db KVStore: миниатюру создал другой процесс"""
+        kv_cache = getattr(default.kvstore, 'cache', None)
+        if kv_cache is not None:
+            kv_cache.delete(add_prefix(self._thumbnail_file(file_, geometry_string, options).key))
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = process_pool(settings.POSTS_THUMBNAIL_WORKERS)
+            threading.Thread(target=_apply_forever, name='thumbnail-ready', daemon=True).start()
+        return _executor
+
+
+def variants():
+    """(формат, ширина, geometry) вариантов карточки; последний формат — запасной для <img>"""
+    width, height = map(int, POST_THUMBNAIL.split('x'))
+    formats = [name for name in settings.POST_IMAGE_FORMATS if name != 'WEBP' or features.check('webp')]
+    return [
+        (name, size, f'{size}x{round(size * height / width)}')
+        for name in formats for size in settings.POST_IMAGE_WIDTHS
+    ]
+
+
+def _create(image):
+    for name, _, geometry in variants():
+        get_thumbnail(image, geometry, format=name, **POST_THUMBNAIL_OPTIONS)
+    return get_thumbnail(image, POST_THUMBNAIL, **POST_THUMBNAIL_OPTIONS)
+
+
+def generate(post_id):
+    """Создаёт миниатюру карточки и её варианты для srcset; выполняется в процессе-воркере"""
+    post = Post.objects.only('image').filter(pk=post_id).first()
+    if post is None or not post.image:
+        return False
+    _create(post.image)
+    return True
+
+
+def mark_ready(post_ids):
+    """Сбрасывает карточки и страницы постов, у которых появилась миниатюра"""
+    posts = Post.objects.filter(pk__in=post_ids).select_related('author', 'group')
+    scopes = set()
+    for post in posts:
+        if post.image:
+            default.backend.forget_missing(post.image, POST_THUMBNAIL, **POST_THUMBNAIL_OPTIONS)
+            for name, _, geometry in variants():
+                default.backend.forget_missing(post.image, geometry, format=name, **POST_THUMBNAIL_OPTIONS)
+        scopes.update(page_cache.post_scopes(post))
+    # Версии карточек и отметки областей становятся видны вместе
+    with serialized_write():
+        Post.objects.filter(pk__in=post_ids).update(version=F('version') + 1)
+        page_cache.touch(*scopes)
+
+
+def apply_ready(block=True):
+    """Применяет mark_ready к постам готовых картинок из очереди; возвращает число картинок"""
+    image_names = []
+    try:
+        image_names.append(_ready.get(block=block))
+        while True:
+            image_names.append(_ready.get_nowait())
+    except queue.Empty:
+        pass
+    if not image_names:
+        return 0
+    try:
+        mark_ready(list(Post.objects.filter(image__in=image_names).values_list('pk', flat=True)))
+    finally:
+        # Поток не получает request_finished, соединения закрываются здесь
+        connections.close_all()
+    return len(image_names)
+
+
+def _apply_forever():
+    while True:
+        try:
+            apply_ready()
+        except Exception:
+            logger.exception('Не удалось сбросить карточки постов с готовыми миниатюрами')
+
+
+def _done(image_name, future):
+    # Колбэк выполняется в служебном потоке пула, бд он не трогает
+    with _lock:
+        _pending.discard(image_name)
+    try:
+        if future.result():
+            _ready.put(image_name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюру %s', image_name)
+
+
+def enqueue(post):
+    """Ставит генерацию миниатюры поста в очередь (или выполняет сразу, если воркеров нет)"""
+    if not post.image:
+        return None
+    image_name = post.image.name
+    if not settings.POSTS_THUMBNAIL_WORKERS:
+        return _create(post.image)
+    with _lock:
+        if image_name in _pending:
+            return None
+        _pending.add(image_name)
+    future = _get_executor().submit(generate_thumbnail, post.pk)
+    future.add_done_callback(lambda future: _done(image_name, future))
+    return None
+
+
+def ready_thumbnail(post):
+    """Готовая миниатюра карточки либо None; недостающая ставится в очередь"""
+    if not post.image:
+        return None
+    thumbnail = default.backend.lookup(post.image, POST_THUMBNAIL, **POST_THUMBNAIL_OPTIONS)
+    return thumbnail or enqueue(post)
+
+
+def _sources(post):
+    sources = {}
+    for name, size, geometry in variants():
+        variant = default.backend.lookup(post.image, geometry, format=name, **POST_THUMBNAIL_OPTIONS)
+        if variant is None:
+            return None
+        sources.setdefault(name, []).append(f'{variant.url} {size}w')
+    return [{'type': MIME_TYPES[name], 'srcset': ', '.join(srcset)} for name, srcset in sources.items()]
+
+
+def ready_image(post):
+    """Миниатюра и srcset по форматам для <picture> либо None, пока миниатюры нет.
+
+    Возвращает {'src': миниатюра, 'sources': [{'type': MIME, 'srcset': ...}, ...]};
+    источники идут в порядке POST_IMAGE_FORMATS, браузер берёт первый знакомый.
+    """
+    thumbnail = ready_thumbnail(post)
+    if thumbnail is None:
+        return None
+    sources = _sources(post)
+    # Пост загружен до появления вариантов: без воркеров они создаются сразу, иначе пока хватит миниатюры
+    if sources is None and enqueue(post) is not None:
+        sources = _sources(post)
+    return {'src': thumbnail, 'sources': sources or []}
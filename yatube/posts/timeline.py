@@ -0,0 +1,202 @@
+"""Материализованная лента подписок (fan-out on write).
+
+При публикации id поста раскладывается в ленты всех подписчиков автора,
+поэтому follow_index читает готовую ленту пользователя вместо join'а
+Follow и Post по всей таблице постов. Для авторов с огромным числом
+подписчиков (UserStats.celebrity) раскладка не делается: их посты
+подмешиваются при чтении. Автор становится таким, когда подписчиков больше
+TIMELINE_FANOUT_LIMIT, а возвращается к раскладке, только опустившись ниже
+порога на TIMELINE_FANOUT_HYSTERESIS: иначе число подписчиков, колеблющееся
+у порога, раз за разом запускало бы раскладку. Отписка лишь ставит такого
+автора в очередь TimelineRefan, а команда refan_timelines пачками по
+подписчикам раскладывает его последние посты и только потом снимает признак —
+до этого посты по-прежнему подмешиваются при чтении и из лент не пропадают.
+
+Глубина ленты ограничена: при подписке и при раскладке в ленту попадают только
+последние TIMELINE_BACKFILL постов автора, более старые горячие посты в ленте
+подписок не видны. Посты, ушедшие в холодное хранение, лента берёт из архива
+(archived) так же, как остальные ленты (posts.archive).
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .counters import stats_for
+from .models import ArchivedPost, Follow, Post, TimelineEntry, TimelineRefan, UserStats
+from .sqlite import serialized_write
+
+
+def is_celebrity(author_id):
+    return stats_for(author_id).celebrity
+
+
+def celebrities_followed_by(user_id):
+    return list(
+        Follow.objects.filter(user_id=user_id, author__stats__celebrity=True).values_list('author_id', flat=True)
+    )
+
+
+def _refan_threshold():
+    return settings.TIMELINE_FANOUT_LIMIT - settings.TIMELINE_FANOUT_HYSTERESIS
+
+
+def _bulk_insert(entries):
+    batch_size = settings.TIMELINE_BATCH_SIZE
+    for start in range(0, len(entries), batch_size):
+        TimelineEntry.objects.bulk_create(entries[start:start + batch_size], ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты подписчиков автора"""
+    if is_celebrity(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(author_id=post.author_id).values_list('user_id', flat=True)
+    _bulk_insert([
+        TimelineEntry(user_id=user_id, post_id=post.id, pub_date=post.pub_date)
+        for user_id in follower_ids.iterator()
+    ])
+
+
+def backfill(user_id, author_id):
+    """После подписки добавляет в ленту последние посты автора"""
+    # Пока автор ждёт раскладки, новым подписчикам посты нужны уже сейчас
+    if is_celebrity(author_id) and not TimelineRefan.objects.filter(author_id=author_id).exists():
+        return
+    posts = (
+        Post.objects.filter(author_id=author_id)
+        .order_by('-pub_date')
+        .values_list('id', 'pub_date')[:settings.TIMELINE_BACKFILL]
+    )
+    _bulk_insert([
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for post_id, pub_date in posts
+    ])
+
+
+def followed(user_id, author_id):
+    """После подписки: переросший порог автор переходит к подмешиванию при чтении, остальным — backfill"""
+    UserStats.objects.filter(
+        user_id=author_id, celebrity=False, followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).update(celebrity=True)
+    backfill(user_id, author_id)
+
+
+def unfollowed(user_id, author_id):
+    """После отписки: убирает посты автора из ленты и ставит в очередь раскладки опустившегося автора"""
+    prune(user_id, author_id)
+    # Без stats_for: при каскадном удалении автора его счётчики создавать заново нельзя
+    if UserStats.objects.filter(
+        user_id=author_id, celebrity=True, followers_count__lte=_refan_threshold()
+    ).exists():
+        TimelineRefan.objects.update_or_create(author_id=author_id)
+
+
+def _insert_recent(author_id, followers=None, since=None):
+    """INSERT…SELECT последних постов автора в ленты подписчиков с user_id в (followers[0], followers[1]]"""
+    conditions, params = ['follow.author_id = %s'], [author_id]
+    if followers is not None:
+        conditions.append('follow.user_id > %s AND follow.user_id <= %s')
+        params.extend(followers)
+    recent = 'author_id = %s'
+    recent_params = [author_id]
+    if since is not None:
+        recent += ' AND pub_date >= %s'
+        recent_params.append(connection.ops.adapt_datetimefield_value(since))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            INSERT INTO {TimelineEntry._meta.db_table} (user_id, post_id, pub_date)
+            SELECT follow.user_id, post.id, post.pub_date
+            FROM {Follow._meta.db_table} follow
+            CROSS JOIN (
+                SELECT id, pub_date FROM {Post._meta.db_table}
+                WHERE {recent}
+                ORDER BY pub_date DESC, id DESC
+                LIMIT %s
+            ) post
+            WHERE {' AND '.join(conditions)}
+            ON CONFLICT DO NOTHING
+            ''',
+            [*recent_params, settings.TIMELINE_BACKFILL, *params],
+        )
+
+
+def refan(author_id, batch_size=None):
+    """Возвращает автора к раскладке при записи: пачками по подписчикам кладёт его последние посты в ленты"""
+    batch_size = batch_size or settings.TIMELINE_BATCH_SIZE
+    pending = UserStats.objects.filter(user_id=author_id, celebrity=True, followers_count__lte=_refan_threshold())
+    if not pending.exists():
+        # Автор снова набрал подписчиков (или удалён), раскладывать нечего
+        TimelineRefan.objects.filter(author_id=author_id).delete()
+        return False
+    started = timezone.now()
+    last = 0
+    while True:
+        with serialized_write():
+            follower_ids = list(
+                Follow.objects.filter(author_id=author_id, user_id__gt=last)
+                .order_by('user_id').values_list('user_id', flat=True)[:batch_size]
+            )
+            if not follower_ids:
+                break
+            _insert_recent(author_id, followers=(last, follower_ids[-1]))
+            last = follower_ids[-1]
+    with serialized_write():
+        UserStats.objects.filter(user_id=author_id).update(celebrity=False)
+        # Посты, опубликованные во время раскладки, пока они ещё подмешивались при чтении
+        _insert_recent(author_id, since=started)
+        TimelineRefan.objects.filter(author_id=author_id).delete()
+    return True
+
+
+def refan_pending(batch_size=None):
+    """Раскладывает посты всех авторов из очереди TimelineRefan; возвращает число разложенных"""
+    author_ids = list(TimelineRefan.objects.order_by('requested').values_list('author_id', flat=True))
+    return sum(refan(author_id, batch_size) for author_id in author_ids)
+
+
+def prune(user_id, author_id):
+    """После отписки убирает посты автора из ленты"""
+    TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+
+def timeline(user_id):
+    """Посты ленты подписок: материализованные записи плюс посты популярных авторов"""
+    celebrities = celebrities_followed_by(user_id)
+    if not celebrities:
+        return Post.objects.filter(timeline_entries__user_id=user_id)
+    entries = TimelineEntry.objects.filter(user_id=user_id).values('post_id')
+    return Post.objects.filter(Q(pk__in=entries) | Q(author_id__in=celebrities))
+
+
+def archived(user_id):
+    """Архивные посты авторов, на которых подписан пользователь"""
+    return ArchivedPost.objects.filter(author__following__user_id=user_id)
+
+
+def rebuild():
+    """Заново раскладывает посты по лентам после массовой загрузки в обход сигналов.
+
+    Каждому подписчику достаются последние TIMELINE_BACKFILL постов автора, как при backfill.
+    """
+    TimelineEntry.objects.all().delete()
+    TimelineRefan.objects.all().delete()
+    UserStats.objects.update(celebrity=False)
+    UserStats.objects.filter(followers_count__gt=settings.TIMELINE_FANOUT_LIMIT).update(celebrity=True)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            INSERT INTO {TimelineEntry._meta.db_table} (user_id, post_id, pub_date)
+            SELECT follow.user_id, post.id, post.pub_date
+            FROM {Follow._meta.db_table} follow
+            JOIN (
+                SELECT id, author_id, pub_date,
+                       ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY pub_date DESC, id DESC) AS position
+                FROM {Post._meta.db_table}
+            ) post ON post.author_id = follow.author_id
+            LEFT JOIN {UserStats._meta.db_table} stats ON stats.user_id = follow.author_id
+            WHERE post.position <= %s AND NOT COALESCE(stats.celebrity, 0)
+            ''',
+            [settings.TIMELINE_BACKFILL],
+        )
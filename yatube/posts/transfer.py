@@ -0,0 +1,146 @@
+"""Перенос групп, постов, комментариев и подписок между окружениями в NDJSON.
+
+Каждая строка — JSON-объект с полем model. На пользователей и группы записи
+ссылаются по username и slug, поэтому их id в окружениях могут не совпадать
+(недостающие пользователи создаются с закрытым входом по паролю); посты и комментарии сохраняют свои id, благодаря чему комментарий находит пост
+без таблицы соответствия, а повторная загрузка той же пачки ничего не дублирует
+(bulk_create с ignore_conflicts). Выгрузка читает таблицы через iterator(),
+загрузка пишет пачками — память не зависит от объёма данных.
+"""
+from django.contrib.auth.hashers import make_password
+from django.db.models import Q
+
+from . import blobs, counters, follow_graph, page_cache, search, timeline, trends
+from .models import ArchivedComment, ArchivedPost, Comment, Follow, Group, Post, User
+from .utils import explicit_dates
+
+MODELS = ('group', 'post', 'comment', 'follow')
+# Сколько соответствий username → id держать между пачками
+USER_CACHE_SIZE = 100000
+
+
+def export_rows(models=MODELS, chunk_size=2000, user=None):
+    """Записи для выгрузки по порядку: группы, посты, комментарии, подписки.
+
+    Посты и комментарии из холодного хранения (posts.archive) выгружаются вместе
+    с остальными и загружаются как обычные. С user — только его посты (и их
+    группы), комментарии и подписки.
+    """
+    groups, follows = Group.objects.all(), Follow.objects.all()
+    posts, comments = [Post.objects.all(), ArchivedPost.objects.all()], [Comment.objects.all(), ArchivedComment.objects.all()]
+    if user is not None:
+        groups = groups.filter(
+            Q(pk__in=Post.objects.filter(author=user).values('group_id'))
+            | Q(pk__in=ArchivedPost.objects.filter(author=user).values('group_id'))
+        )
+        posts = [queryset.filter(author=user) for queryset in posts]
+        comments = [queryset.filter(author=user) for queryset in comments]
+        follows = follows.filter(user=user)
+    querysets = {
+        'group': [groups.order_by('pk').values('slug', 'title', 'description')],
+        'post': [
+            queryset.order_by('pk').values('id', 'text', 'pub_date', 'image', 'author__username', 'group__slug')
+            for queryset in posts
+        ],
+        'comment': [
+            queryset.order_by('pk').values('id', 'post_id', 'author__username', 'text', 'created')
+            for queryset in comments
+        ],
+        'follow': [follows.order_by('pk').values('user__username', 'author__username')],
+    }
+    renames = {'author__username': 'author', 'group__slug': 'group', 'user__username': 'user', 'post_id': 'post'}
+    for model in MODELS:
+        if model not in models:
+            continue
+        for queryset in querysets[model]:
+            for row in queryset.iterator(chunk_size=chunk_size):
+                yield {'model': model, **{renames.get(name, name): value for name, value in row.items()}}
+
+
+class Loader:
+    """Загружает пачки записей одной модели; пользователи и группы ищутся по username и slug"""
+
+    def __init__(self, create_users=True):
+        self.create_users = create_users
+        self.users = {}
+        self.groups = {}
+        self.missing_users = 0
+
+    def user_ids(self, usernames):
+        needed = set(usernames)
+        wanted = needed - self.users.keys()
+        if not wanted:
+            return self.users
+        if len(self.users) + len(wanted) > USER_CACHE_SIZE:
+            self.users = {name: self.users[name] for name in needed - wanted}
+        found = dict(User.objects.filter(username__in=wanted).values_list('username', 'id'))
+        missing = wanted - found.keys()
+        if missing and self.create_users:
+            # Вход по паролю у них закрыт, пароль задаётся через восстановление
+            password = make_password(None)
+            User.objects.bulk_create([User(username=name, password=password) for name in missing])
+            found.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        self.missing_users += len(wanted - found.keys())
+        self.users.update(found)
+        return self.users
+
+    def group_ids(self, slugs):
+        wanted = set(filter(None, slugs)) - self.groups.keys()
+        if wanted:
+            self.groups.update(Group.objects.filter(slug__in=wanted).values_list('slug', 'id'))
+        return self.groups
+
+    def load(self, model, records):
+        """Сохраняет записи модели model, пропуская уже загруженные; возвращает число сопоставленных"""
+        return getattr(self, f'load_{model}')(records)
+
+    def load_group(self, records):
+        groups = [Group(slug=row['slug'], title=row['title'], description=row['description']) for row in records]
+        return len(Group.objects.bulk_create(groups, ignore_conflicts=True))
+
+    def load_post(self, records):
+        users = self.user_ids(row['author'] for row in records)
+        groups = self.group_ids(row['group'] for row in records)
+        posts = [
+            Post(
+                id=row['id'], text=row['text'], pub_date=row['pub_date'], image=row['image'] or None,
+                author_id=users[row['author']], group_id=groups.get(row['group']),
+            )
+            for row in records if row['author'] in users
+        ]
+        with explicit_dates(Post, 'pub_date'):
+            return len(Post.objects.bulk_create(posts, ignore_conflicts=True))
+
+    def load_comment(self, records):
+        users = self.user_ids(row['author'] for row in records)
+        # Пост мог не загрузиться (например, без автора); комментарий к нему нарушил бы внешний ключ
+        posts = set(Post.objects.filter(pk__in=[row['post'] for row in records]).values_list('pk', flat=True))
+        comments = [
+            Comment(
+                id=row['id'], post_id=row['post'], author_id=users[row['author']], text=row['text'],
+                created=row['created'],
+            )
+            for row in records if row['author'] in users and row['post'] in posts
+        ]
+        with explicit_dates(Comment, 'created'):
+            return len(Comment.objects.bulk_create(comments, ignore_conflicts=True))
+
+    def load_follow(self, records):
+        users = self.user_ids([row['user'] for row in records] + [row['author'] for row in records])
+        follows = [
+            Follow(user_id=users[row['user']], author_id=users[row['author']])
+            for row in records if row['user'] in users and row['author'] in users
+        ]
+        return len(Follow.objects.bulk_create(follows, ignore_conflicts=True))
+
+
+def rebuild_derived():
+    """Пересчитывает всё, что сигналы поддерживают при обычной записи"""
+    counters.reconcile_users(User.objects.all())
+    counters.reconcile_comments()
+    timeline.rebuild()
+    search.rebuild()
+    trends.rebuild()
+    blobs.rebuild()
+    follow_graph.invalidate()
+    page_cache.touch(page_cache.SITE)
@@ -0,0 +1,133 @@
+"""Популярные посты и группы.
+
+Оценка — сумма весов событий (публикация, комментарий), каждый из которых
+затухает вдвое за TRENDING_HALF_LIFE. Чтобы не пересчитывать затухание при
+каждом событии, оценки хранятся с «прямым» затуханием: событие в момент t
+добавляет weight * 2 ** ((t - epoch) / half_life), где epoch — общая точка
+отсчёта из TrendEpoch. От настоящей оценки такая отличается на общий для всех
+строк множитель, поэтому порядок тот же, а событие — один UPDATE score = score + w
+без чтения. Первые N читаются по индексу на score за O(N).
+
+Множитель растёт со временем, поэтому команда rebase_trends (по расписанию,
+не реже раза в TRENDING_REBASE_AFTER) переносит точку отсчёта на текущий
+момент: оценки умножаются на общий коэффициент, ничтожно малые удаляются.
+Если команду долго не запускали, перенос перед переполнением делает сама запись.
+Точка отсчёта читается из бд в той же пишущей транзакции, что и UPDATE оценки,
+поэтому событие не может сложиться со старым множителем после переноса.
+"""
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import page_cache
+from .models import Comment, GroupTrend, Post, PostTrend, TrendEpoch
+from .sqlite import serialized_write
+
+# За сколько периодов полураспада rebuild() учитывает события, более старые уже ничтожны
+REBUILD_HALF_LIVES = 10
+# Сколько периодов полураспада может пройти от точки отсчёта, прежде чем запись
+# перенесёт её сама: 2 ** 512 далеко от переполнения float (2 ** 1024), даже
+# если команду rebase_trends месяцами не запускали
+MAX_HALF_LIVES = 512
+
+
+def epoch():
+    """Текущая точка отсчёта; внутри пишущей транзакции её не сдвинет другой процесс"""
+    row, _ = TrendEpoch.objects.select_for_update().get_or_create(pk=1, defaults={'started': timezone.now()})
+    return row.started
+
+
+def weight(amount, started, at=None):
+    """Вклад события в оценку относительно точки отсчёта started"""
+    at = at.timestamp() if at is not None else time.time()
+    return amount * 2 ** ((at - started.timestamp()) / settings.TRENDING_HALF_LIFE)
+
+
+def _bump(model, pk, score):
+    if not model.objects.filter(pk=pk).update(score=F('score') + score):
+        _, created = model.objects.get_or_create(pk=pk, defaults={'score': score})
+        if not created:
+            model.objects.filter(pk=pk).update(score=F('score') + score)
+
+
+def _record(post_id, group_id, amount):
+    with serialized_write():
+        started = epoch()
+        if time.time() - started.timestamp() > MAX_HALF_LIVES * settings.TRENDING_HALF_LIFE:
+            rebase()
+            started = epoch()
+        score = weight(amount, started)
+        _bump(PostTrend, post_id, score)
+        if group_id:
+            _bump(GroupTrend, group_id, score)
+        page_cache.touch('trending')
+
+
+def record_post(post):
+    _record(post.pk, post.group_id, settings.TRENDING_POST_WEIGHT)
+
+
+def record_comment(comment):
+    _record(comment.post_id, comment.post.group_id, settings.TRENDING_COMMENT_WEIGHT)
+
+
+def rebase(now=None):
+    """Переносит точку отсчёта на now; возвращает число удалённых ничтожных оценок"""
+    now = now or timezone.now()
+    removed = 0
+    with serialized_write():
+        epoch, _ = TrendEpoch.objects.select_for_update().get_or_create(pk=1, defaults={'started': now})
+        # Коэффициент берётся из сохранённой точки отсчёта, так что повторный rebase ничего не испортит
+        factor = 2 ** ((epoch.started - now).total_seconds() / settings.TRENDING_HALF_LIFE)
+        for model in (PostTrend, GroupTrend):
+            model.objects.update(score=F('score') * factor)
+            removed += model.objects.filter(score__lt=settings.TRENDING_MIN_SCORE).delete()[0]
+        epoch.started = now
+        epoch.save()
+    return removed
+
+
+def rebuild(batch_size=1000):
+    """Заново считает оценки по постам и комментариям после массовой загрузки в обход сигналов"""
+    now = timezone.now()
+    since = now - timedelta(seconds=settings.TRENDING_HALF_LIFE * REBUILD_HALF_LIVES)
+    posts, groups = Counter(), Counter()
+    events = [
+        (Post.objects.filter(pub_date__gte=since).values_list('pk', 'group_id', 'pub_date'),
+         settings.TRENDING_POST_WEIGHT),
+        (Comment.objects.filter(created__gte=since).values_list('post_id', 'post__group_id', 'created'),
+         settings.TRENDING_COMMENT_WEIGHT),
+    ]
+    for rows, amount in events:
+        for post_id, group_id, at in rows.iterator():
+            score = weight(amount, now, at)
+            posts[post_id] += score
+            if group_id:
+                groups[group_id] += score
+    minimum = settings.TRENDING_MIN_SCORE
+    # Оценки посчитаны от now: новая точка отсчёта записывается вместе с ними
+    with serialized_write():
+        PostTrend.objects.all().delete()
+        GroupTrend.objects.all().delete()
+        TrendEpoch.objects.update_or_create(pk=1, defaults={'started': now})
+        PostTrend.objects.bulk_create(
+            (PostTrend(pk=pk, score=score) for pk, score in posts.items() if score >= minimum), batch_size=batch_size
+        )
+        GroupTrend.objects.bulk_create(
+            (GroupTrend(pk=pk, score=score) for pk, score in groups.items() if score >= minimum), batch_size=batch_size
+        )
+        page_cache.touch('trending')
+
+
+def top_posts(limit):
+    ids = list(PostTrend.objects.order_by('-score').values_list('post_id', flat=True)[:limit])
+    posts = Post.objects.feed().in_bulk(ids)
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+def hot_groups(limit):
+    return [trend.group for trend in GroupTrend.objects.select_related('group').order_by('-score')[:limit]]
@@ -1,19 +1,33 @@
+from django.conf import settings
 from django.urls import path
 
+from . import api
 from .views import *
 
+if settings.ASYNC_VIEWS:
+    from .async_views import follow_index, index, post_view, profile
+
 urlpatterns = [
     path('', index, name='index'),
+    path('trending/', trending, name='trending'),
     path('author/<str:username>/', profile, name='profile'),
+    path('author/<str:username>/export/', export_data, name='export_data'),
     path('author/<str:username>/<int:post_id>', post_view, name='post'),
     path('author/<str:username>/<int:post_id>/edit', post_edit, name='post_edit'),
     path('author/<str:username>/<int:post_id>/comment', add_comment, name='add_comment'),
+    path('author/<str:username>/<int:post_id>/comments', post_comments, name='post_comments'),
     path('group/<slug>/', group_posts, name='group_posts'),
     path('new/', new_post, name='new_post'),
+    path('search/', search, name='search'),
     path('follow/', follow_index, name="follow_index"),
     path('followers/', followers_index, name="followers_index"),
     path('follow/<str:username>/', profile_follow, name="profile_follow"),
     path('unfollow/<str:username>/', profile_unfollow, name="profile_unfollow"),
+    path('api/v1/posts/', api.index, name='api_index'),
+    path('api/v1/group/<slug>/', api.group_posts, name='api_group_posts'),
+    path('api/v1/author/<str:username>/', api.profile, name='api_profile'),
+    path('api/v1/author/<str:username>/<int:post_id>/', api.post_view, name='api_post'),
+    path('api/v1/follow/', api.follow_index, name='api_follow_index'),
     path('404/', page_not_found),
     path('500/', server_error),
 
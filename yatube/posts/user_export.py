@@ -0,0 +1,93 @@
+"""Архив данных пользователя: его посты, комментарии, подписки и исходные изображения.
+
+Zip собирается на лету: zipfile пишет в буфер без seek (тогда он сам ставит
+дескрипторы данных после каждого файла), а генератор ответа отдаёт накопленное
+после каждого записанного куска. Ни архив, ни изображение целиком в памяти не
+оказываются, временных файлов нет. data.ndjson — в формате export_ndjson, его
+можно загрузить командой import_ndjson.
+"""
+import json
+import time
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import transfer
+from .models import ArchivedPost, Post
+from .storage import blob_storage
+
+CHUNK_SIZE = 64 * 1024
+NDJSON_LINES = 500
+
+
+class _Buffer:
+    """Файлоподобный приёмник для ZipFile; накопленное забирает pop()"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _pending(buffer):
+    data = buffer.pop()
+    if data:
+        yield data
+
+
+def _ndjson(user):
+    lines = []
+    for row in transfer.export_rows(user=user):
+        lines.append(json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder))
+        if len(lines) == NDJSON_LINES:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def _read(image):
+    with image:
+        yield from iter(lambda: image.read(CHUNK_SIZE), b'')
+
+
+def _entries(user):
+    yield 'data.ndjson', _ndjson(user), zipfile.ZIP_DEFLATED
+    images = [
+        model.objects.filter(author=user).exclude(image='').exclude(image=None).values_list('image', flat=True)
+        for model in (Post, ArchivedPost)
+    ]
+    # Один файл может быть у нескольких постов, в архив он попадает один раз (UNION без ALL)
+    for name in images[0].union(images[1]).order_by('image').iterator():
+        try:
+            image = blob_storage.open(name, 'rb')
+        except OSError:
+            # Файл могли удалить с диска вручную, архив без него всё равно полезен
+            continue
+        # JPEG и PNG уже сжаты
+        yield name, _read(image), zipfile.ZIP_STORED
+
+
+def stream(user):
+    """Куски zip-архива с данными пользователя"""
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, chunks, compression in _entries(user):
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    yield from _pending(buffer)
+            yield from _pending(buffer)
+    yield from _pending(buffer)
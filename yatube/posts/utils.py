@@ -1,8 +1,213 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import json
+import math
+from contextlib import contextmanager
 
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
 
-def post_paginator(request, post_list, count=10):
-    paginator = Paginator(post_list, count)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает список значений из токена либо None, если токен испорчен"""
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class CursorPage:
+    """Страница keyset-пагинации, совместимая по интерфейсу с шаблонами Page"""
+
+    def __init__(self, object_list, number, next_query=None, previous_query=None, first_query='',
+                 estimated_pages=None):
+        self.object_list = object_list
+        self.number = number
+        self.first_query = first_query
+        self.next_query = next_query
+        self.previous_query = previous_query
+        self.estimated_pages = estimated_pages
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_query is not None
+
+    def has_previous(self):
+        return self.previous_query is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def show_first_page(self):
+        return self.number > 2
+
+    def show_last_page(self):
+        return self.estimated_pages is not None and self.estimated_pages > self.number + 1
+
+
+class CursorPaginator:
+    """Keyset-пагинация по убыванию полей ``fields`` (последнее поле должно быть уникальным).
+
+    Вместо COUNT(*) и OFFSET страница выбирается условием «строго после/до курсора»,
+    поэтому глубокие страницы стоят столько же, сколько первая. Курсор — непрозрачный
+    токен со значениями полей граничной записи и номером страницы.
+
+    archive — queryset с теми же полями в холодном хранении. Страница горячих
+    записей, которая целиком новее границы — самой свежей записи archive, —
+    читает из архива только эту границу, одним запросом по индексу. Горячие
+    записи, граница и архив читаются в одной транзакции: перенос пачки в архив
+    между ними не даст ни пропусков, ни повторов.
+    """
+
+    def __init__(self, object_list, per_page, fields=('pub_date', 'id'), total=None, archive=None):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.fields = fields
+        self.total = total
+        self.archive = archive
+
+    @property
+    def estimated_pages(self):
+        if self.total is None:
+            return None
+        return max(1, math.ceil(self.total / self.per_page))
+
+    def _value(self, row, field):
+        return row[field] if isinstance(row, dict) else getattr(row, field)
+
+    def _token(self, row, number):
+        return encode_cursor([self._value(row, field) for field in self.fields] + [number])
+
+    def _parse(self, token):
+        values = decode_cursor(token) if token else None
+        if values is None or len(values) != len(self.fields) + 1:
+            return None, None
+        model = self.object_list.model
+        try:
+            keys = [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+            number = int(values[-1])
+        except (ValidationError, TypeError, ValueError):
+            return None, None
+        return keys, number
+
+    def _keys(self, row):
+        return tuple(self._value(row, field) for field in self.fields)
+
+    def _boundary(self):
+        return self.archive.order_by(*[f'-{field}' for field in self.fields]).values_list(*self.fields).first()
+
+    def _rows(self, condition, order, cursor=None):
+        """per_page + 1 записей по порядку order; архив подмешивается, только если без него нельзя"""
+        limit = self.per_page + 1
+        if self.archive is None:
+            return list(self.object_list.filter(condition).order_by(*order)[:limit])
+        with transaction.atomic(using=self.object_list.db):
+            rows = list(self.object_list.filter(condition).order_by(*order)[:limit])
+            newest_first = order[0].startswith('-')
+            if not newest_first or len(rows) == limit:
+                boundary = self._boundary()
+                if boundary is None:
+                    return rows
+                if newest_first and self._keys(rows[-1]) > boundary:
+                    return rows
+                if not newest_first and tuple(cursor) > boundary:
+                    return rows
+            archived = list(self.archive.filter(condition).order_by(*order)[:limit])
+        return sorted(rows + archived, key=self._keys, reverse=newest_first)[:limit]
+
+    def _beyond(self, keys, older):
+        """Условие «запись строго старше (или новее) курсора» для составного ключа"""
+        lookup = 'lt' if older else 'gt'
+        condition = Q()
+        for position, field in enumerate(self.fields):
+            equal = {name: keys[index] for index, name in enumerate(self.fields[:position])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': keys[position]})
+        return condition
+
+    def page(self, after=None, before=None):
+        """Возвращает (записи, номер страницы, токен «дальше», токен «назад»)"""
+        descending = [f'-{field}' for field in self.fields]
+        keys, number = self._parse(after or before)
+        if keys is not None and after:
+            rows = self._rows(self._beyond(keys, older=True), descending)
+            number += 1
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            next_token = self._token(rows[-1], number) if has_more else None
+            previous_token = self._token(rows[0], number) if rows else None
+        elif keys is not None:
+            rows = self._rows(self._beyond(keys, older=False), self.fields, cursor=keys)
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page][::-1]
+            number = max(number - 1, 2) if has_more else 1
+            next_token = self._token(rows[-1], number) if rows else None
+            previous_token = self._token(rows[0], number) if has_more else None
+        else:
+            rows = self._rows(Q(), descending)
+            number = 1
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            next_token = self._token(rows[-1], number) if has_more else None
+            previous_token = None
+        return rows, number, next_token, previous_token
+
+
+def page_query(request, **params):
+    query = request.GET.copy()
+    for key in ('after', 'before', 'page'):
+        query.pop(key, None)
+    query.update(params)
+    return query.urlencode()
+
+
+def post_paginator(request, post_list, count=10, total=None, archive=None):
+    """Страница ленты; archive — те же посты в холодном хранении (posts.archive)"""
+    paginator = CursorPaginator(post_list, count, total=total, archive=archive)
+    rows, number, next_token, previous_token = paginator.page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    page = CursorPage(
+        rows,
+        number,
+        next_query=page_query(request, after=next_token) if next_token else None,
+        previous_query=(
+            None if previous_token is None
+            else page_query(request) if number == 2
+            else page_query(request, before=previous_token)
+        ),
+        first_query=page_query(request),
+        estimated_pages=paginator.estimated_pages,
+    )
     return page, paginator
+
+
+@contextmanager
+def explicit_dates(model, *fields):
+    """Позволяет bulk_create сохранить заданные значения полей с auto_now_add"""
+    model_fields = [model._meta.get_field(name) for name in fields]
+    for field in model_fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in model_fields:
+            field.auto_now_add = True
@@ -1,59 +1,125 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 
-from .forms import PostForm, CommentForm
-from .models import Post, Group, User, Comment, Follow
-from .utils import post_paginator
+from . import follow_graph, search as post_search, thumbnails, trends, user_export
+from .db_router import use_primary
+from .sqlite import serialized_write
+from .forms import PostForm, CommentForm, SearchForm
+from .counters import stats_for
+from .models import ArchivedComment, ArchivedPost, Post, Group, User, Comment, Follow
+from .page_cache import SITE, anonymous_page_cache, etag_func, last_modified_func
+from .timeline import archived as archived_timeline, timeline
+from .utils import CursorPage, CursorPaginator, page_query, post_paginator
 
 
-# @cache_page(20)
+@anonymous_page_cache(lambda: ['index', SITE])
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    page, paginator = post_paginator(request, post_list)
+    post_list = Post.objects.feed()
+    page, paginator = post_paginator(request, post_list, archive=ArchivedPost.objects.feed())
     return render(request, 'index.html', {'page': page, 'paginator': paginator})
 
 
+@anonymous_page_cache(lambda: ['trending', SITE])
+def trending(request):
+    """Самые обсуждаемые посты по затухающей оценке (posts.trends)"""
+    return render(request, 'trending.html', {'posts': trends.top_posts(settings.TRENDING_SIZE)})
+
+
+def group_scopes(slug):
+    return [f'group:{slug}', SITE]
+
+
+def profile_scopes(username):
+    return [f'profile:{username}', SITE]
+
+
+def post_page_scopes(username, post_id):
+    # На странице поста есть и счётчик постов автора из его профиля
+    return [f'post:{post_id}', f'profile:{username}', SITE]
+
+
+@condition(etag_func=etag_func(group_scopes), last_modified_func=last_modified_func(group_scopes))
+@anonymous_page_cache(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = Post.objects.filter(group=group).order_by('-pub_date')
-    page, paginator = post_paginator(request, posts, 5)
+    posts = Post.objects.feed().filter(group=group)
+    archived = ArchivedPost.objects.feed().filter(group=group)
+    page, paginator = post_paginator(request, posts, 5, archive=archived)
     return render(request, 'posts/group.html', {'group': group, 'page': page, 'paginator': paginator})
 
 
+@condition(etag_func=etag_func(profile_scopes), last_modified_func=last_modified_func(profile_scopes))
+@anonymous_page_cache(profile_scopes)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=author).order_by('-pub_date')
-    followers = Follow.objects.filter(author=author).count()
-    following = Follow.objects.filter(user=author).count()
-    page, paginator = post_paginator(request, posts, 5)
-    context = {
+    posts = Post.objects.feed().filter(author=author)
+    archived = ArchivedPost.objects.feed().filter(author=author)
+    # posts_count учитывает и архивные посты
+    stats = stats_for(author.id)
+    page, paginator = post_paginator(request, posts, 5, total=stats.posts_count, archive=archived)
+    return render(request, 'posts/profile.html', {
         'page': page,
         'paginator': paginator,
         'author': author,
-        'posts_count': len(posts),
-        'followers': followers,
-        'following': following,
-    }
-    if request.user.id:
-        follow = Follow.objects.filter(user=request.user, author=author).count()
-        context['follow'] = follow
-    return render(request, 'posts/profile.html', context)
+        'posts_count': stats.posts_count,
+        'followers': follow_graph.followers_count(author.id),
+        'following': follow_graph.following_count(author.id),
+        'follow': follow_graph.is_following(request.user.id, author.id),
+    })
+
+
+@login_required
+def export_data(request, username):
+    """Zip с постами, комментариями, подписками и изображениями автора; только ему самому и персоналу"""
+    author = get_object_or_404(User, username=username)
+    if request.user != author and not request.user.is_staff:
+        raise PermissionDenied
+    response = StreamingHttpResponse(user_export.stream(author), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{author.username}-export.zip"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def find_post(post_id, **filters):
+    """Пост из горячей таблицы, а если его там нет — из архива (posts.archive)"""
+    post = Post.objects.feed().filter(pk=post_id, **filters).first()
+    return post or get_object_or_404(ArchivedPost.objects.feed(), pk=post_id, **filters)
+
+
+def comments_page(request, post_id, archived=False):
+    """Комментарии поста от новых к старым, по COMMENTS_PER_PAGE за раз; курсор — «старше чем»"""
+    model = ArchivedComment if archived else Comment
+    comments = model.objects.filter(post_id=post_id).select_related('author')
+    paginator = CursorPaginator(comments, settings.COMMENTS_PER_PAGE, fields=('created', 'id'))
+    comment_list, _, comments_next, _ = paginator.page(after=request.GET.get('after'))
+    return {'comment_list': comment_list, 'comments_next': comments_next}
 
 
+@condition(etag_func=etag_func(post_page_scopes), last_modified_func=last_modified_func(post_page_scopes))
 def post_view(request, username, post_id):
     author = get_object_or_404(User, username=username)
-    comment_list = Comment.objects.order_by('-created').filter(post=post_id)
-    post = get_object_or_404(Post, pk=post_id)
-    posts = Post.objects.filter(author=author).all() # noqa
+    post = find_post(post_id)
     return render(request, 'posts/post.html', {
         'post': post,
         'author': author,
-        'posts_count': len(posts),
-        'comment_list': comment_list,
+        'posts_count': stats_for(author.id).posts_count,
+        **comments_page(request, post_id, archived=isinstance(post, ArchivedPost)),
     })
 
 
+@condition(etag_func=etag_func(post_page_scopes), last_modified_func=last_modified_func(post_page_scopes))
+def post_comments(request, username, post_id):
+    """Фрагмент со следующей страницей комментариев для кнопки «Загрузить ещё»"""
+    post = find_post(post_id, author__username=username)
+    archived = isinstance(post, ArchivedPost)
+    return render(request, 'comments_page.html', {'post': post, **comments_page(request, post_id, archived)})
+
+
 @login_required()
 def new_post(request):
     bound_form = PostForm(request.POST or None, files=request.FILES or None)
@@ -61,7 +127,9 @@ def new_post(request):
         if bound_form.is_valid():
             post = bound_form.save(commit=False)
             post.author = request.user
-            post.save()
+            with serialized_write():
+                post.save()
+                transaction.on_commit(lambda: thumbnails.enqueue(post))
             return redirect('index')
         # return render(request, 'posts/new_post.html', {'form': bound_form})
     # form = PostForm
@@ -75,7 +143,10 @@ def post_edit(request, username, post_id):
         bound_form = PostForm(request.POST or None, files=request.FILES or None, instance=post)
         if request.method == 'POST':
             if bound_form.is_valid():
-                bound_form.save()
+                with serialized_write():
+                    bound_form.save()
+                    if 'image' in bound_form.changed_data:
+                        transaction.on_commit(lambda: thumbnails.enqueue(post))
                 return redirect('post', username=post.author, post_id=post.id)
         return render(request, 'posts/new_post.html', {'form': bound_form, 'post': 1})
     return redirect('post', username=username, post_id=post_id)
@@ -84,64 +155,85 @@ def post_edit(request, username, post_id):
 @login_required()
 def add_comment(request, username, post_id):
     author = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=author).all()
-    post = get_object_or_404(Post, id=post_id)
-    comment_list = Comment.objects.order_by('-created').filter(post=post_id)
+    post = find_post(post_id)
+    if isinstance(post, ArchivedPost):
+        # Архивные посты только для чтения
+        return redirect('post', username=username, post_id=post_id)
     form = CommentForm(request.POST or None)
     if request.method == 'POST':
         if form.is_valid():
             comment = form.save(commit=False)
             comment.author = request.user
             comment.post = post
-            comment.save()
+            with serialized_write():
+                comment.save()
             return redirect('index')
     return render(request, 'posts/post.html', {
         'form': form,
         'post': post,
-        'comment_list': comment_list,
-        'posts_count': len(posts),
+        'posts_count': stats_for(author.id).posts_count,
         'author': author,
+        **comments_page(request, post_id),
     })
 
 
 @login_required
 def follow_index(request):
-    # follows = Follow.objects.filter(user=request.user)
-    # author_list = []
-    # for follow in follows:
-    #     author_list.append(follow.author)
-    # post_list = Post.objects.filter(author__in=author_list).order_by('-pub_date')
-    """У поля Follow.author через related_name находим связи с (всех подписанных пользователей) Follow.user
-    Ищем все посты, авторы которых = Follow.author, а Follow.user = текущему пользователю
-    author__follower__author=request.user - посты всех пользователей, которые подписаны на текущего"""
-    post_list = Post.objects.filter(author__following__user=request.user).order_by('-pub_date')
-    page, paginator = post_paginator(request, post_list)
+    """Лента подписок читается из материализованной ленты пользователя (posts.timeline),
+    посты в неё раскладываются при публикации и подписке; архивные — из posts.archive"""
+    post_list = timeline(request.user.id).feed()
+    page, paginator = post_paginator(request, post_list, archive=archived_timeline(request.user.id).feed())
     return render(request, "follow.html", {'page': page, 'paginator': paginator})
 
 
 @login_required
 def followers_index(request):
-    post_list = Post.objects.filter(author__follower__author=request.user).order_by('-pub_date')
-    page, paginator = post_paginator(request, post_list)
+    post_list = Post.objects.feed().filter(author__follower__author=request.user)
+    archived = ArchivedPost.objects.feed().filter(author__follower__author=request.user)
+    page, paginator = post_paginator(request, post_list, archive=archived)
     return render(request, "followers.html", {'page': page, 'paginator': paginator})
 
 
+@use_primary
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if Follow.objects.filter(user=request.user, author=author).count() == 0 and request.user != author:
-        Follow.objects.create(user=request.user, author=author)
+    # Индекс подписок только для отображения, решает всегда бд
+    if request.user != author:
+        with serialized_write():
+            Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('profile', username=username)
 
 
+@use_primary
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    if Follow.objects.filter(user=request.user, author=author).count() == 1:
-        Follow.objects.get(user=request.user, author=author).delete()
+    with serialized_write():
+        Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('profile', username=username)
 
 
+def search(request):
+    form = SearchForm(request.GET or None)
+    page = None
+    if form.is_valid():
+        posts, number, next_cursor = post_search.search(
+            form.cleaned_data['q'],
+            group=form.cleaned_data['group'],
+            author=form.cleaned_data['author'],
+            after=request.GET.get('after'),
+        )
+        page = CursorPage(
+            posts,
+            number,
+            next_query=page_query(request, after=next_cursor) if next_cursor else None,
+            previous_query=page_query(request) if number == 2 else None,
+            first_query=page_query(request),
+        )
+    return render(request, 'posts/search.html', {'form': form, 'page': page})
+
+
 def page_not_found(request, exception):
     return render(
         request,
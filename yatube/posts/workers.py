@@ -0,0 +1,23 @@
+"""Точки входа для процессов-воркеров (пул запускается методом spawn).
+
+Модуль не импортирует ничего из Django на верхнем уровне: воркер сначала
+распаковывает ссылку на функцию и только потом вызывает init_worker.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+
+def init_worker():
+    import django
+
+    django.setup()
+
+
+def process_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=init_worker)
+
+
+def generate_thumbnail(post_id):
+    from .thumbnails import generate
+
+    return generate(post_id)
@@ -30,13 +30,15 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sites',
     'django.contrib.flatpages',
-    'posts',
+    'posts.apps.PostsConfig',
     'users',
     'sorl.thumbnail',
     'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'posts.metrics.MetricsMiddleware',
+    'posts.db_router.PrimaryReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,7 +53,7 @@ ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'posts.metrics.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -72,12 +74,50 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# Соединения живут CONN_MAX_AGE секунд и переиспользуются следующими запросами
+# того же потока (в том числе потоками асинхронных вьюх, posts.async_views), так
+# что открытие файла и PRAGMA из SQLITE_PRAGMAS не повторяются на каждый запрос.
+# Соединение после ошибки Django проверяет и закрывает, если оно неработоспособно.
+CONN_MAX_AGE = 60
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+    }
+}
+
+# Реплики для чтения (posts.db_router): YATUBE_DB_REPLICAS — файлы SQLite через
+# запятую, для локальной проверки их заполняет команда sync_replicas. Тесты
+# запускаются без реплик, маршрутизацию проверяют через override_settings.
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('YATUBE_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name.strip(),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['posts.db_router.PrimaryReplicaRouter']
+
+# Параметры каждого соединения с SQLite (posts.sqlite) по порядку: ожидание чужой
+# записи до 5 с (и при переключении журнала), WAL, чтобы чтения не ждали записи,
+# 64 МБ кэша страниц и 256 МБ mmap.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
 }
+# Пишущие вьюхи процесса выполняются по одной (posts.sqlite.serialized_write)
+SQLITE_SERIALIZE_WRITES = os.environ.get('YATUBE_SQLITE_SERIALIZE_WRITES', '1') == '1'
+# Сколько секунд после записи браузер читает с основной базы
+PRIMARY_PIN_SECONDS = 10
+PRIMARY_PIN_COOKIE = 'primary_pin'
 
 
 # Password validation
@@ -99,9 +139,13 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Кэш у каждого процесса свой: версии страниц (posts.page_cache) и журнал
+# подписок (posts.follow_graph) хранятся в бд, поэтому от общего кэша зависит
+# только доля попаданий, а не свежесть ответов
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
     }
 }
 
@@ -137,3 +181,76 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
+
+# Лента подписок (posts.timeline): авторы, у которых подписчиков больше
+# TIMELINE_FANOUT_LIMIT, не раскладываются по лентам при публикации,
+# их посты подмешиваются при чтении. Обратно к раскладке автор возвращается,
+# опустившись ниже порога на TIMELINE_FANOUT_HYSTERESIS, — раскладку делает
+# команда refan_timelines. При подписке и раскладке в ленту кладутся только
+# последние TIMELINE_BACKFILL постов автора — это глубина истории ленты подписок.
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_FANOUT_HYSTERESIS = 500
+TIMELINE_BACKFILL = 200
+TIMELINE_BATCH_SIZE = 1000
+
+# Индекс подписок в памяти процесса (posts.follow_graph) сверяется с журналом
+# в бд не чаще раза в столько секунд; свои изменения процесс видит сразу.
+FOLLOW_GRAPH_SYNC_INTERVAL = 1
+
+# Кэш отрендеренных карточек постов (posts.fragments)
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Кэш страниц для анонимов (posts.page_cache) сбрасывается сигналами,
+# таймаут лишь ограничивает время жизни неиспользуемых записей.
+PAGE_CACHE_TIMEOUT = 60 * 60
+PAGE_CACHE_LOCK_TIMEOUT = 10
+# Сколько секунд запрос ждёт страницу, которую впервые считает другой запрос,
+# прежде чем посчитать её сам
+PAGE_CACHE_WAIT = 2
+
+# Миниатюры постов создаются в пуле процессов (posts.thumbnails);
+# 0 — создавать сразу в процессе запроса.
+THUMBNAIL_BACKEND = 'posts.thumbnails.ThumbnailBackend'
+POSTS_THUMBNAIL_WORKERS = int(os.environ.get('POSTS_THUMBNAIL_WORKERS', 2))
+
+# Варианты изображения карточки для srcset: ширины и форматы в порядке
+# предпочтения, последний — запасной для <img>; WebP пропускается, если
+# Pillow собран без него. Загрузки больше POST_IMAGE_MAX_PIXELS форма
+# отклоняет по заголовку файла, не декодируя изображение.
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+# Метрики запросов (posts.metrics): доля запросов с подробными замерами
+# и заголовком Server-Timing, адреса, которым открыт /metrics.
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.05))
+METRICS_ALLOWED_IPS = INTERNAL_IPS
+
+# Комментарии на странице поста выводятся порциями, остальные догружаются
+COMMENTS_PER_PAGE = 20
+
+# Сколько рекомендаций «на кого подписаться» хранится на пользователя (posts.recommendations)
+RECOMMENDATIONS_PER_USER = 20
+
+# Популярное (posts.trends): веса публикации и комментария, период полураспада
+# оценки, через сколько команда rebase_trends (её запускают по расписанию)
+# переносит точку отсчёта, с какой оценки строка удаляется и сколько постов и
+# групп показывать.
+TRENDING_POST_WEIGHT = 3
+TRENDING_COMMENT_WEIGHT = 1
+TRENDING_HALF_LIFE = 6 * 60 * 60
+TRENDING_REBASE_AFTER = 7 * 24 * 60 * 60
+TRENDING_MIN_SCORE = 0.05
+TRENDING_SIZE = 20
+HOT_GROUPS_SIZE = 5
+
+# Посты старше стольких дней команда archive_posts переносит в холодное
+# хранение (posts.archive); ленты читают архив, только дойдя до его границы.
+ARCHIVE_AFTER_DAYS = 365
+
+# Асинхронные варианты лент и профиля (posts.async_views) для запуска под ASGI;
+# yatube/asgi.py включает их сам. Синхронный debug toolbar там только мешает.
+ASYNC_VIEWS = os.environ.get('YATUBE_ASYNC_VIEWS') == '1'
+if ASYNC_VIEWS:
+    MIDDLEWARE.remove('debug_toolbar.middleware.DebugToolbarMiddleware')
+    SILENCED_SYSTEM_CHECKS = ['debug_toolbar.W001']
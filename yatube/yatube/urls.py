@@ -6,12 +6,15 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from posts.metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('about/', include('django.contrib.flatpages.urls')),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('posts.urls')),
     path('__debug__/', include(debug_toolbar.urls)),
 ]